@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Compares shutil.copy2 (one file at a time) with search_utils.copy_files, using each
+copy method, for many small files and for a few large files.
+
+Usage: benchmark_copy_files.py [small_file_count] [large_file_count] [large_file_megabytes]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'utils'))
+import search_utils
+
+SMALL_FILE_COUNT = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+LARGE_FILE_COUNT = int(sys.argv[2]) if len(sys.argv) > 2 else 2
+LARGE_FILE_MEGABYTES = int(sys.argv[3]) if len(sys.argv) > 3 else 1024
+SMALL_FILE_BYTES = 4096
+
+def write_files(input_dir, file_count, file_bytes):
+    """
+    Writes file_count files of file_bytes random bytes to input_dir, and returns their names
+    """
+    input_filenames = []
+    for file_number in range(file_count):
+        input_filename = os.path.join(input_dir, 'file_{0}.dat'.format(file_number))
+        with open(input_filename, 'wb') as input_file:
+            for _ in range(0, file_bytes, search_utils.COPY_BUFFER_SIZE):
+                input_file.write(os.urandom(min(file_bytes, search_utils.COPY_BUFFER_SIZE)))
+        input_filenames.append(input_filename)
+    return input_filenames
+
+def time_copy(description, input_filenames, copy_func):
+    """
+    Copies input_filenames to a new directory with copy_func(copy_plan), and prints the time and throughput
+    """
+    output_dir = tempfile.mkdtemp()
+    try:
+        copy_plan = [(f, os.path.join(output_dir, os.path.basename(f))) for f in input_filenames]
+        start_time = time.time()
+        copy_func(copy_plan)
+        elapsed = time.time() - start_time
+        total_megabytes = sum(os.path.getsize(f) for f in input_filenames) / 1024.0 / 1024.0
+        print('{0}: {1:.2f}s ({2:.1f} MB/s, {3:.0f} files/s)'.format(description, elapsed, total_megabytes / elapsed, len(input_filenames) / elapsed))
+    finally:
+        shutil.rmtree(output_dir)
+
+def copy2_files(copy_plan):
+    """
+    Copies each (input, output) pair in copy_plan with shutil.copy2, the way copy_file used to
+    """
+    for input_filename, output_filename in copy_plan:
+        shutil.copy2(input_filename, output_filename)
+
+if __name__ == '__main__':
+    for workload, file_count, file_bytes in (('small', SMALL_FILE_COUNT, SMALL_FILE_BYTES), ('large', LARGE_FILE_COUNT, LARGE_FILE_MEGABYTES * 1024 * 1024)):
+        input_dir = tempfile.mkdtemp()
+        try:
+            input_filenames = write_files(input_dir, file_count, file_bytes)
+            time_copy('{0}, shutil.copy2'.format(workload), input_filenames, copy2_files)
+            for copy_method in search_utils.COPY_METHODS:
+                try:
+                    search_utils.copy_file_data(input_filenames[0], os.path.join(input_dir, 'method_test'), [copy_method])
+                    os.remove(os.path.join(input_dir, 'method_test'))
+                except OSError:
+                    print('{0}, {1}: not supported'.format(workload, copy_method))
+                    continue
+                for worker_count in (1, search_utils.DEFAULT_COPY_WORKERS):
+                    time_copy('{0}, {1}, {2} workers'.format(workload, copy_method, worker_count), input_filenames,
+                              lambda p: search_utils.copy_files(p, worker_count, copy_methods=[copy_method]))
+            time_copy('{0}, copy_files (verify)'.format(workload), input_filenames, lambda p: search_utils.copy_files(p, verify=True))
+        finally:
+            shutil.rmtree(input_dir)
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Compares bunzip2_and_rename's decompression throughput for each supported codec,
+and for several worker counts, on synthetic log files.
+
+Usage: benchmark_expand_codecs.py [file_count] [file_megabytes]
+"""
+import bz2
+import gzip
+import lzma
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import bunzip2_and_rename
+
+FILE_COUNT = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+FILE_MEGABYTES = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+COMPRESSORS = {
+    'bz2': bz2.compress,
+    'gz': gzip.compress,
+    'xz': lzma.compress
+}
+if bunzip2_and_rename.zstandard is not None:
+    COMPRESSORS['zst'] = bunzip2_and_rename.zstandard.ZstdCompressor().compress
+
+def get_log_data(megabytes):
+    """
+    Returns about megabytes of log-like text
+    """
+    random.seed(megabytes)
+    words = ['GET', 'POST', '/api/offers', '/api/merchants', '200', '404', 'user', 'session', 'ok', 'error']
+    lines = []
+    line_count = 0
+    while line_count < megabytes * 1024 * 1024:
+        line = '2017-05-09 09:00:{0:02d} {1}\n'.format(random.randint(0, 59), ' '.join(random.choice(words) for _ in range(12)))
+        lines.append(line)
+        line_count += len(line)
+    return ''.join(lines).encode('utf-8')
+
+def write_compressed_files(output_dir, codec, file_count, file_data):
+    """
+    Writes file_count copies of file_data, compressed by codec, with a trailing timestamp, and returns their names
+    """
+    compressed_data = COMPRESSORS[codec](file_data)
+    compressed_filenames = []
+    for file_number in range(file_count):
+        compressed_filename = os.path.join(output_dir, 'log_{0}.txt.2017-05-09-09:00:{1:02d}.{2}'.format(file_number, file_number % 60, codec))
+        with open(compressed_filename, 'wb') as compressed_file:
+            compressed_file.write(compressed_data)
+        compressed_filenames.append(compressed_filename)
+    return compressed_filenames
+
+if __name__ == '__main__':
+    file_data = get_log_data(FILE_MEGABYTES)
+    for codec in sorted(COMPRESSORS):
+        test_dir = tempfile.mkdtemp()
+        try:
+            compressed_filenames = write_compressed_files(test_dir, codec, FILE_COUNT, file_data)
+            for worker_count in sorted(set([1, 2, 4, os.cpu_count()])):
+                start_time = time.time()
+                with open(os.devnull, 'w') as devnull:
+                    stdout, sys.stdout = sys.stdout, devnull
+                    try:
+                        bunzip2_and_rename.decompress_files(compressed_filenames, worker_count)
+                    finally:
+                        sys.stdout = stdout
+                elapsed = time.time() - start_time
+                print('{0}, {1} workers: {2:.2f}s ({3:.1f} MB/s)'.format(codec, worker_count, elapsed, FILE_COUNT * len(file_data) / 1024.0 / 1024.0 / elapsed))
+        finally:
+            shutil.rmtree(test_dir)
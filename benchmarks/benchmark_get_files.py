@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Compares futils.get_files (Path.glob) with futils.iter_files (os.scandir), and with
+get_files answered from an up to date dir_index.DirectoryIndex, on a synthetic
+directory tree, with and without an exclusion list.
+
+Usage: benchmark_get_files.py [dir_count] [files_per_dir]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'utils'))
+import dir_index
+import futils
+
+DIR_COUNT = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+FILES_PER_DIR = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+EXCLUSION_LIST = ['.git', '.cache', 'node_modules']
+
+def make_tree(root_dir, dir_count, files_per_dir):
+    """
+    Creates dir_count nested directories under root_dir, with files_per_dir files in each.
+    Some of the directories match EXCLUSION_LIST.
+    """
+    for dir_number in range(dir_count):
+        dir_parts = [root_dir, 'd{0}'.format(dir_number % 10), 'd{0}'.format(dir_number % 100), 'd{0}'.format(dir_number)]
+        if dir_number % 10 == 0:
+            dir_parts.append(EXCLUSION_LIST[dir_number % len(EXCLUSION_LIST)])
+        dir_name = os.path.join(*dir_parts)
+        os.makedirs(dir_name)
+        for file_number in range(files_per_dir):
+            open(os.path.join(dir_name, 'file{0}.{1}'.format(file_number, 'txt' if file_number % 2 else 'log')), 'w').close()
+
+def time_walk(description, walk_func):
+    """
+    Prints the best time for walk_func
+    """
+    file_count = len(list(walk_func()))
+    print('{0}: {1:.3f}s ({2} paths)'.format(description, min(timeit.repeat(lambda: list(walk_func()), number=1, repeat=3)), file_count))
+
+if __name__ == '__main__':
+    root_dir = tempfile.mkdtemp()
+    try:
+        make_tree(root_dir, DIR_COUNT, FILES_PER_DIR)
+        time_walk('get_files', lambda: futils.get_files(root_dir, '*.txt'))
+        time_walk('iter_files', lambda: futils.iter_files(root_dir, '*.txt'))
+        time_walk('iter_file_entries', lambda: futils.iter_file_entries(root_dir, '*.txt'))
+        with dir_index.DirectoryIndex(os.path.join(tempfile.gettempdir(), 'benchmark_get_files.sqlite')) as index:
+            index.refresh(root_dir)
+            time_walk('get_files (index)', lambda: futils.get_files(root_dir, '*.txt', index=index))
+        os.remove(os.path.join(tempfile.gettempdir(), 'benchmark_get_files.sqlite'))
+        time_walk('get_files (exclusions)', lambda: futils.get_files(root_dir, '*.txt', exclusion_list=EXCLUSION_LIST))
+        time_walk('iter_files (exclusions)', lambda: futils.iter_files(root_dir, '*.txt', exclusion_list=EXCLUSION_LIST))
+    finally:
+        shutil.rmtree(root_dir)
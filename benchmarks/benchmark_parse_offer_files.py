@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Compares extracting offer merchants from a synthetic corpus of offer files one file at a
+time (like parseJSONFile.py used to) with the parallel getMerchants pipeline.
+
+Usage: benchmark_parse_offer_files.py [file_count] [offers_per_file]
+"""
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import parseJSONFile
+
+FILE_COUNT = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+OFFERS_PER_FILE = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+
+def write_offer_files(output_dir, file_count, offers_per_file):
+    """
+    Writes file_count offer files to output_dir, whose offers share merchant ids, and returns their names
+    """
+    offer_files = []
+    for file_number in range(file_count):
+        offers = [{
+            'id': (file_number * offers_per_file + i) % (file_count * 5),
+            'name': ' Merchant {0} '.format(i),
+            'primaryCategory': 'Category {0}'.format(i % 10),
+            'description': 'x' * 200,
+            'locations': [{'city': 'City', 'postal': '{0:05d}'.format(i)}] * 3
+        } for i in range(offers_per_file)]
+        offer_file = os.path.join(output_dir, 'offers_{0}.json'.format(file_number))
+        with open(offer_file, 'w') as output_file:
+            json.dump({'results': offers}, output_file)
+        offer_files.append(offer_file)
+    return offer_files
+
+def get_merchants_serially(offer_files):
+    """
+    Returns the merchants from offer_files, decoding one file at a time in this process
+    """
+    merchants = {}
+    for offer_file in offer_files:
+        with open(offer_file, 'tr', encoding='utf-8') as input_file:
+            offers_json = json.loads(''.join(input_file.readlines()).strip('\n'))
+        for offer in offers_json['results']:
+            merchants[offer['id']] = {
+                'name': offer.get('name', '').strip(),
+                'category': offer.get('primaryCategory', '').strip(),
+                'source': offer_file
+            }
+    return list(merchants.values())
+
+def time_run(description, run_func):
+    """
+    Prints how long run_func took
+    """
+    start_time = time.time()
+    merchant_count = run_func()
+    elapsed = time.time() - start_time
+    print('{0}: {1:.2f}s ({2:,.0f} files/s, {3} merchants)'.format(description, elapsed, FILE_COUNT / elapsed, merchant_count))
+
+if __name__ == '__main__':
+    test_dir = tempfile.mkdtemp()
+    try:
+        offer_files = write_offer_files(test_dir, FILE_COUNT, OFFERS_PER_FILE)
+        output_file = os.path.join(test_dir, 'offer_merchants.csv')
+        time_run('serial', lambda: parseJSONFile.writeMerchants(get_merchants_serially(offer_files), output_file))
+        for worker_count in sorted(set([1, 2, 4, os.cpu_count()])):
+            time_run('{0} workers'.format(worker_count), lambda: parseJSONFile.writeMerchants(parseJSONFile.getMerchants(offer_files, worker_count), output_file))
+    finally:
+        shutil.rmtree(test_dir)
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Compares the speed of read_delimited_file's naive split parsing with its csv
+dialect parsing, on a synthetic file of unquoted records, and times the csv dialect
+parsing of a file where every record has a quoted value (which csv.reader has to parse).
+
+Usage: benchmark_read_delimited_file.py [record_count]
+"""
+import os
+import sys
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'utils'))
+import file_utils
+
+FIELD_NAMES = ['posted_status', 'transaction_date', 'merchant_name', 'payment_category', 'transaction_amount']
+RECORD_COUNT = int(sys.argv[1]) if len(sys.argv) > 1 else 500000
+
+def write_test_file(filename, record_count, quote_merchants=False):
+    """
+    Writes record_count records, with a header row, to filename. If quote_merchants is True,
+    the merchant names are quoted, and contain the delimiter.
+    """
+    merchant_format = '"Merchant {1}, Inc"' if quote_merchants is True else 'Merchant {1}'
+    record_format = 'posted,05/{0:02d}/2017,' + merchant_format + ',category {2},-{3}.{4:02d}\n'
+    with open(filename, 'wt') as test_file:
+        test_file.write(','.join(FIELD_NAMES) + '\n')
+        for i in range(record_count):
+            test_file.write(record_format.format(i % 28 + 1, i % 1000, i % 12, i % 500, i % 100))
+
+def time_reader(filename, **kwargs):
+    """
+    Returns the best time, in seconds, of reading every record in filename
+    """
+    run_reader = lambda: sum(1 for _ in file_utils.read_delimited_file(filename, field_names=FIELD_NAMES, **kwargs))
+    return min(timeit.repeat(run_reader, number=1, repeat=3))
+
+if __name__ == '__main__':
+    test_dir = tempfile.mkdtemp()
+    test_filename = os.path.join(test_dir, 'records.csv')
+    quoted_filename = os.path.join(test_dir, 'quoted_records.csv')
+    try:
+        write_test_file(test_filename, RECORD_COUNT)
+        write_test_file(quoted_filename, RECORD_COUNT, quote_merchants=True)
+        split_time = time_reader(test_filename)
+        csv_time = time_reader(test_filename, dialect='excel')
+        quoted_time = time_reader(quoted_filename, dialect='excel')
+        print('{0} records'.format(RECORD_COUNT))
+        print('split:        {0:.3f}s ({1:,.0f} records/s)'.format(split_time, RECORD_COUNT / split_time))
+        print('csv:          {0:.3f}s ({1:,.0f} records/s)'.format(csv_time, RECORD_COUNT / csv_time))
+        print('csv (quoted): {0:.3f}s ({1:,.0f} records/s)'.format(quoted_time, RECORD_COUNT / quoted_time))
+    finally:
+        for filename in (test_filename, quoted_filename):
+            if os.path.exists(filename):
+                os.remove(filename)
+        os.rmdir(test_dir)
@@ -2,28 +2,71 @@
 from __future__ import (absolute_import, division, generators, nested_scopes, print_function, unicode_literals, with_statement)
 from bz2 import decompress, BZ2File
 import glob
+from gzip import GzipFile
+import hashlib
+import json
+from multiprocessing import Pool
 import os
 import re
 import sys
+import time
+try:
+    from lzma import LZMAFile
+except ImportError:
+    LZMAFile = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 """
-Decompresses bz2 files in a given path, and outputs the result to a file with the same name
-as the source file, minus the .bz2 extension as well as a trailing timestamp, if it exists.
+Decompresses bz2, gzip, xz, and zstd files in a given path, and outputs the result to a file with
+the same name as the source file, minus the compression extension as well as a trailing timestamp,
+if they exist. The compression type is found from the start of each file, not its extension.
+Files that have the same name once the timestamp is removed (rotated logs) are appended into
+one file, in the order of their names.
+xz files need Python 3.3+, and zstd files need the zstandard package.
 This script was made to work in Python 2.6+
 
 Examples:
     some-random-filename.json.2017-05-09-09:00:06.bz2 -> some-random-filename.json
     SOME_OTHER_RANDOM_FILENAME_20170613_102515.TXT.2017-06-13-10:17:01.bz2 -> SOME_OTHER_RANDOM_FILENAME_20170613_102515.TXT
+    some-random-filename.json.2017-05-09-09:00:06.gz -> some-random-filename.json
 """
 
 TIMESTAMP_PATTERN = re.compile(r'(\.?\d\d\d\d\-\d\d\-\d\d\-\d\d[\-\:]\d\d[\-\:]\d\d$)')
+# The bytes that each type of compressed file starts with
+CODEC_SIGNATURES = [
+    (b'BZh', 'bz2'),
+    (b'\x1f\x8b', 'gz'),
+    (b'\xfd7zXZ\x00', 'xz'),
+    (b'\x28\xb5\x2f\xfd', 'zst')
+]
+COMPRESSED_EXTENSIONS = ['.bz2', '.gz', '.xz', '.zst', '.zstd']
+# zstd frames start with this (little-endian) value, and skippable frames with this one, plus 0-15
+ZSTD_FRAME_MAGIC = 0xfd2fb528
+ZSTD_SKIPPABLE_MAGIC = 0x184d2a50
+# Decompressed output is written to a temporary name, made of the output name, the process id
+# and this extension, and renamed once it is complete
+PARTIAL_EXTENSION = '.partial'
+# Number of decompressed bytes that are held in memory at a time, for each file
+BUFFER_SIZE = 1024 * 1024
+# bz2 blocks start with this 48 bit value, and streams end with the second one, followed by
+# the stream's CRC. Neither is aligned to a byte.
+BZ2_BLOCK_MAGIC = 0x314159265359
+BZ2_END_MAGIC = 0x177245385090
+# Number of compressed bytes that are searched for block boundaries at a time
+BLOCK_SCAN_SIZE = 64 * 1024 * 1024
 
 def show_help():
     """
     Shows some help for the script
     """
-    print('Decompresses and renames files to match their expected original name')
-    print('Usage: bunzip_and_rename file_path')
+    print('Decompresses (bz2, gzip, xz, zstd) and renames files to match their expected original name')
+    print('Usage: bunzip_and_rename [--workers count] [--manifest manifest_file] [--blocks] file_path [file_path ...]')
     print('    file_path: Either a path to process for files, or a single file to process')
+    print('    --workers: The number of files to decompress at once. Defaults to the number of CPUs')
+    print('    --manifest: A file that records finished files, so that they are skipped if the script is run again')
+    print('    --blocks: Decompress one file at a time, splitting bz2 blocks between the workers (Python 3 only)')
 
 
 def get_files(dir_names):
@@ -58,35 +101,556 @@ def get_files(dir_names):
             except TypeError as te_err:
                 print('Error trying to get files from {0}!\nError details: {1}'.format(dir_name, te_err))
 
-        return_files.update(set([dir_file for dir_file in dir_files if dir_file.lower().endswith('.bz2')]))
+        return_files.update(set([dir_file for dir_file in dir_files if has_decompressed_filename(dir_file) and get_codec(dir_file) is not None]))
     return return_files
 
-if len(sys.argv) >= 1:
+def has_decompressed_filename(compressed_filename):
+    """
+    Returns True if compressed_filename has a compression extension or timestamp to remove
+    (see get_decompressed_filename). Other files are skipped without being opened, even if
+    they happen to start with a compression signature.
+    """
+    try:
+        get_decompressed_filename(compressed_filename)
+        return True
+    except IOError:
+        return False
+
+def get_codec(filename):
+    """
+    Returns the type of compression used for filename (bz2, gz, xz, or zst), based on
+    the bytes that it starts with. Returns None if it is not a supported compressed file.
+    """
+    try:
+        input_file = open(filename, 'rb')
+        try:
+            file_start = input_file.read(6)
+        finally:
+            input_file.close()
+    except (IOError, OSError):
+        return None
+
+    for signature, codec in CODEC_SIGNATURES:
+        if file_start.startswith(signature):
+            return codec
+    return None
+
+def open_compressed_file(compressed_filename, codec):
+    """
+    Returns a file object that reads decompressed bytes from compressed_filename
+    """
+    if codec == 'bz2':
+        return BZ2File(compressed_filename, 'rb')
+    elif codec == 'gz':
+        return GzipFile(compressed_filename, 'rb')
+    elif codec == 'xz' and LZMAFile is not None:
+        return LZMAFile(compressed_filename, 'rb')
+    elif codec == 'zst' and zstandard is not None:
+        return ZstdFile(compressed_filename)
+    raise IOError('{0} files are not supported by this version of Python!'.format(codec))
+
+def check_zstd_frames(compressed_filename):
+    """
+    Walks the frame and block headers of the zstd file compressed_filename, without
+    decompressing it, and raises an EOFError if the file ends inside a frame.
+    zstandard's stream_reader treats a truncated file as a shorter one.
+    """
+    compressed_file = open(compressed_filename, 'rb')
+    try:
+        def read_exactly(byte_count):
+            read_bytes = compressed_file.read(byte_count)
+            if len(read_bytes) < byte_count:
+                raise EOFError('Compressed file ended before the end-of-stream marker was reached')
+            return read_bytes
+
+        frame_magic = compressed_file.read(4)
+        while frame_magic:
+            if len(frame_magic) < 4:
+                raise EOFError('Compressed file ended before the end-of-stream marker was reached')
+            magic_value = int.from_bytes(frame_magic, 'little')
+            if magic_value & 0xfffffff0 == ZSTD_SKIPPABLE_MAGIC:
+                compressed_file.seek(int.from_bytes(read_exactly(4), 'little'), os.SEEK_CUR)
+            elif magic_value == ZSTD_FRAME_MAGIC:
+                descriptor = read_exactly(1)[0]
+                single_segment = (descriptor >> 5) & 1
+                content_size_bytes = (single_segment, 2, 4, 8)[descriptor >> 6]
+                dict_id_bytes = (0, 1, 2, 4)[descriptor & 3]
+                read_exactly((1 - single_segment) + dict_id_bytes + content_size_bytes)
+                is_last_block = False
+                while not is_last_block:
+                    block_header = int.from_bytes(read_exactly(3), 'little')
+                    is_last_block = block_header & 1 == 1
+                    block_type = (block_header >> 1) & 3
+                    # RLE blocks hold a single byte, however long they are decompressed
+                    read_exactly(1 if block_type == 1 else block_header >> 3)
+                if descriptor & 4:
+                    read_exactly(4)
+            else:
+                raise IOError('The file is not a zstd file, or is corrupt')
+            frame_magic = compressed_file.read(4)
+    finally:
+        compressed_file.close()
+
+class ZstdFile(object):
+    """
+    Reads decompressed bytes from a zstd file, one frame after another, with zstandard's
+    stream_reader, so each read returns at most the requested number of bytes. The frames
+    are checked first (see check_zstd_frames), so it raises an EOFError if the file ends
+    inside a frame, the same as the other codecs do for truncated files.
+    """
+    def __init__(self, compressed_filename):
+        check_zstd_frames(compressed_filename)
+        self.compressed_file = open(compressed_filename, 'rb')
+        self.reader = zstandard.ZstdDecompressor().stream_reader(self.compressed_file, read_size=BUFFER_SIZE,
+                                                                  read_across_frames=True)
+
+    def read(self, size):
+        return self.reader.read(size)
+
+    def close(self):
+        self.reader.close()
+        self.compressed_file.close()
+
+def get_decompressed_filename(compressed_filename):
+    """
+    Returns the name that compressed_filename should be decompressed to
+    """
+    # Remove the compression extension
+    decompressed_filename = compressed_filename
+    for extension in COMPRESSED_EXTENSIONS:
+        if decompressed_filename.lower().endswith(extension):
+            decompressed_filename = decompressed_filename[:-len(extension)]
+            break
+
+    # If a timestamp is appended to the remaining filename, clean it out
+    decompressed_filename = TIMESTAMP_PATTERN.sub('', decompressed_filename)
+    if decompressed_filename == compressed_filename:
+        raise IOError('The file has no extension or timestamp to remove, so it would be overwritten!')
+    return decompressed_filename
+
+def replace_file(source_filename, destination_filename):
+    """
+    Renames source_filename to destination_filename, replacing it if it exists.
+    The rename is atomic on the same file system, so destination_filename is never partly written.
+    """
+    if hasattr(os, 'replace'):
+        os.replace(source_filename, destination_filename)
+    else:
+        # Windows can't rename over an existing file before Python 3.3
+        if os.name == 'nt' and os.path.exists(destination_filename):
+            os.remove(destination_filename)
+        os.rename(source_filename, destination_filename)
+
+def get_partial_filename(decompressed_filename):
+    """
+    Returns the temporary name that decompressed_filename is written to. It includes the
+    process id, so that runs that overlap never write the same temporary file.
+    """
+    return '{0}.{1}{2}'.format(decompressed_filename, os.getpid(), PARTIAL_EXTENSION)
+
+def remove_partial_file(partial_filename):
+    """
+    Removes partial_filename, if it exists
+    """
+    if partial_filename is not None and os.path.exists(partial_filename):
+        os.remove(partial_filename)
+
+def write_decompressed(compressed_filename, decompressed_file, output_hash, pool=None):
+    """
+    Decompresses compressed_filename to the end of decompressed_file, BUFFER_SIZE bytes at a time,
+    so that the file never needs to fit in memory. Returns the number of bytes written, and
+    output_hash updated with them. If pool is provided, bz2 files are split into blocks that are
+    decompressed by pool, and written in order as they finish. If the blocks can not be verified
+    (see get_bz2_blocks), or a block cannot be decompressed on its own, what was written is removed,
+    and the file is decompressed as a stream instead, which reports truncated or corrupt files.
+    """
+    codec = get_codec(compressed_filename)
+    if pool is not None and codec == 'bz2':
+        start_position = decompressed_file.tell()
+        block_hash = output_hash.copy()
+        bytes_written = 0
+        try:
+            blocks = get_bz2_blocks(compressed_filename)
+            for block_data in pool.imap(decompress_bz2_block, ((compressed_filename, start, end) for start, end in blocks)):
+                decompressed_file.write(block_data)
+                block_hash.update(block_data)
+                bytes_written += len(block_data)
+            return bytes_written, block_hash
+        except (IOError, OSError, ValueError, EOFError):
+            decompressed_file.seek(start_position)
+            decompressed_file.truncate()
+
+    bytes_written = 0
+    compressed_file = open_compressed_file(compressed_filename, codec)
+    try:
+        file_data = compressed_file.read(BUFFER_SIZE)
+        while file_data:
+            decompressed_file.write(file_data)
+            output_hash.update(file_data)
+            bytes_written += len(file_data)
+            file_data = compressed_file.read(BUFFER_SIZE)
+    finally:
+        compressed_file.close()
+    return bytes_written, output_hash
+
+def get_output_groups(compressed_filenames):
+    """
+    Returns a list of lists of compressed_filenames, grouped by the name that they are decompressed
+    to, in sorted order. Rotated files like app.json.2017-05-09-09:00:06.bz2 and
+    app.json.2017-05-10-09:00:06.bz2 are both decompressed to app.json, so they have to be written
+    by one worker, one after the other. Files that have no name to decompress to are each in a
+    group of their own, so that their error is reported.
+    """
+    output_groups = {}
+    for compressed_filename in sorted(compressed_filenames):
+        try:
+            group_key = (0, os.path.normcase(os.path.abspath(get_decompressed_filename(compressed_filename))))
+        except IOError:
+            group_key = (1, compressed_filename)
+        output_groups.setdefault(group_key, []).append(compressed_filename)
+    return [output_groups[k] for k in sorted(output_groups)]
+
+def decompress_group(compressed_filenames, pool=None):
+    """
+    Decompresses compressed_filenames, which must all have the same decompressed filename (see
+    get_output_groups), into that file, appending each one in order. The output is written to a
+    temporary file, which is renamed once the whole group is complete, so if any file fails, the
+    output is not written. If pool is provided, bz2 files are split into blocks that are decompressed
+    by pool (see write_decompressed).
+    Returns a list with a tuple for each of compressed_filenames: the compressed filename, the
+    decompressed filename, the compressed and decompressed sizes in bytes, the seconds taken, an
+    error message (or None), and the SHA-1 of the decompressed file.
+    The error message is only None if the end of every compressed stream in the group was reached,
+    and its checksum matched, so a truncated or corrupt file is never reported as finished.
+    """
+    decompressed_filename = None
+    partial_filename = None
+    output_hash = hashlib.sha1()
+    file_results = {}
+    error_message = None
+    try:
+        decompressed_filename = get_decompressed_filename(compressed_filenames[0])
+        partial_filename = get_partial_filename(decompressed_filename)
+        decompressed_file = open(partial_filename, 'wb')
+        try:
+            for compressed_filename in compressed_filenames:
+                start_time = time.time()
+                compressed_size = os.path.getsize(compressed_filename)
+                bytes_written, output_hash = write_decompressed(compressed_filename, decompressed_file, output_hash, pool)
+                file_results[compressed_filename] = (compressed_size, bytes_written, time.time() - start_time)
+        finally:
+            decompressed_file.close()
+        replace_file(partial_filename, decompressed_filename)
+    # Each codec raises its own error types for corrupt files
+    except Exception as decompress_err:
+        error_message = str(decompress_err)
+        remove_partial_file(partial_filename)
+
+    failed_filename = None
+    if error_message is not None:
+        failed_filename = next((f for f in compressed_filenames if f not in file_results), None)
+    group_results = []
+    for compressed_filename in compressed_filenames:
+        compressed_size, bytes_written, seconds = file_results.get(compressed_filename, (None, 0, 0))
+        file_error = error_message
+        if failed_filename is not None and compressed_filename != failed_filename:
+            file_error = 'The output was not written, since {0} could not be decompressed'.format(failed_filename)
+        group_results.append((compressed_filename, decompressed_filename, compressed_size,
+                              bytes_written, seconds, file_error, output_hash.hexdigest()))
+    return group_results
+
+def decompress_file(compressed_filename):
+    """
+    Decompresses compressed_filename on its own. Returns the same tuple as decompress_group
+    does for each file.
+    """
+    return decompress_group([compressed_filename])[0]
+
+def get_magic_patterns(magic):
+    """
+    Returns a list of (bit_shift, search_bytes) for the 48 bit magic value. search_bytes
+    are the bytes that are always found when magic starts bit_shift bits into a byte,
+    starting at the first byte after the one that magic starts in.
+    """
+    magic_patterns = []
+    for bit_shift in range(8):
+        shifted_bytes = (magic << (16 - bit_shift)).to_bytes(8, 'big')
+        magic_patterns.append((bit_shift, shifted_bytes[1:6]))
+    return magic_patterns
+
+def find_bz2_markers(compressed_filename, scan_size=BLOCK_SCAN_SIZE):
+    """
+    Returns a sorted list of (bit_offset, is_block_start) for every block start and stream end
+    in compressed_filename, reading scan_size bytes at a time. A block ends at the next marker.
+    The magic values could also appear by chance inside compressed data, in which case
+    decompressing those blocks will fail.
+    """
+    magic_patterns = [(magic, get_magic_patterns(magic)) for magic in (BZ2_BLOCK_MAGIC, BZ2_END_MAGIC)]
+    markers = set()
+    # Keep enough of the previous chunk to find a magic value that spans two chunks
+    overlap_size = 8
+    with open(compressed_filename, 'rb') as compressed_file:
+        chunk_start = 0
+        chunk = compressed_file.read(scan_size)
+        while chunk:
+            next_data = compressed_file.read(scan_size)
+            for magic, patterns in magic_patterns:
+                for bit_shift, search_bytes in patterns:
+                    found_at = chunk.find(search_bytes, 1)
+                    while found_at != -1:
+                        window = chunk[found_at - 1:found_at + 7]
+                        if len(window) == 8 and (int.from_bytes(window, 'big') >> (16 - bit_shift)) & 0xffffffffffff == magic:
+                            markers.add(((chunk_start + found_at - 1) * 8 + bit_shift, magic == BZ2_BLOCK_MAGIC))
+                        found_at = chunk.find(search_bytes, found_at + 1)
+            if not next_data:
+                break
+            chunk_start += len(chunk) - overlap_size
+            chunk = chunk[-overlap_size:] + next_data
+    return sorted(markers)
+
+def read_bits(input_file, bit_offset, bit_count):
+    """
+    Returns bit_count bits of input_file, starting bit_offset bits into it, as an int.
+    Raises an EOFError if the file ends first.
+    """
+    input_file.seek(bit_offset // 8)
+    byte_count = (bit_offset % 8 + bit_count + 7) // 8
+    read_bytes = input_file.read(byte_count)
+    if len(read_bytes) < byte_count:
+        raise EOFError('Compressed file ended before the end-of-stream marker was reached')
+    read_value = int.from_bytes(read_bytes, 'big') >> (byte_count * 8 - bit_offset % 8 - bit_count)
+    return read_value & ((1 << bit_count) - 1)
+
+def get_bz2_blocks(compressed_filename):
+    """
+    Returns a list of (start_bit, end_bit) for each block in compressed_filename.
+    Raises a ValueError if the blocks do not account for the whole file: the last marker must be
+    a stream end, and each stream's CRC must match the combined CRC of its blocks (which also
+    catches magic values that appear by chance inside compressed data).
+    """
+    markers = find_bz2_markers(compressed_filename)
+    if len(markers) == 0 or markers[-1][1] is True:
+        raise ValueError('Compressed file ended before the end-of-stream marker was reached')
+
+    blocks = []
+    with open(compressed_filename, 'rb') as compressed_file:
+        combined_crc = 0
+        for (bit_offset, is_block_start), (next_offset, _) in zip(markers, markers[1:] + [(None, None)]):
+            # The 32 bit block or stream CRC follows each magic value
+            marker_crc = read_bits(compressed_file, bit_offset + 48, 32)
+            if is_block_start:
+                blocks.append((bit_offset, next_offset))
+                combined_crc = (((combined_crc << 1) | (combined_crc >> 31)) & 0xffffffff) ^ marker_crc
+            else:
+                if marker_crc != combined_crc:
+                    raise ValueError('The stream CRC does not match its blocks, so a block boundary was misread')
+                combined_crc = 0
+    return blocks
+
+def decompress_bz2_block(block_details):
+    """
+    Decompresses one block of a bz2 file, and returns the decompressed bytes.
+    block_details is a tuple of the filename, and the block's start and end bit.
+    The block is copied into a stream of its own, which is followed by the stream end
+    magic value and the stream CRC (which is the block's CRC, for a single block).
+    """
+    compressed_filename, start_bit, end_bit = block_details
+    with open(compressed_filename, 'rb') as compressed_file:
+        compressed_file.seek(start_bit // 8)
+        block_bytes = compressed_file.read((end_bit + 7) // 8 - start_bit // 8)
+
+    bit_count = end_bit - start_bit
+    block_bits = int.from_bytes(block_bytes, 'big')
+    block_bits >>= len(block_bytes) * 8 - (start_bit % 8) - bit_count
+    block_bits &= (1 << bit_count) - 1
+    # The 32 bit CRC follows the block magic value
+    block_crc = (block_bits >> (bit_count - 80)) & 0xffffffff
+
+    stream_bits = (((block_bits << 48) | BZ2_END_MAGIC) << 32) | block_crc
+    bit_count += 80
+    padding = (8 - bit_count % 8) % 8
+    stream_bytes = b'BZh9' + (stream_bits << padding).to_bytes((bit_count + padding) // 8, 'big')
+    return decompress(stream_bytes)
+
+def decompress_file_blocks(compressed_filename, pool):
+    """
+    Decompresses compressed_filename by splitting it into bz2 blocks and decompressing
+    them in pool (see write_decompressed). Returns the same tuple as decompress_file.
+    """
+    return decompress_group([compressed_filename], pool)[0]
+
+def get_source_state(compressed_filename):
+    """
+    Returns the size and modified time of compressed_filename, as they are saved in the manifest
+    """
+    file_stats = os.stat(compressed_filename)
+    return {'source_size': file_stats.st_size, 'source_mtime': file_stats.st_mtime}
+
+def read_manifest(manifest_filename):
+    """
+    Returns the entries in manifest_filename, keyed by the absolute path of the compressed file.
+    The manifest has one JSON entry per line, and later lines replace earlier ones for the same file.
+    A line that was cut off by an interrupted run is ignored.
+    """
+    manifest = {}
+    if manifest_filename is None or not os.path.exists(manifest_filename):
+        return manifest
+    manifest_file = open(manifest_filename, 'r')
+    try:
+        for manifest_line in manifest_file:
+            try:
+                manifest_entry = json.loads(manifest_line)
+            except ValueError:
+                continue
+            manifest[manifest_entry['source']] = manifest_entry
+    finally:
+        manifest_file.close()
+    return manifest
+
+def get_file_checksum(filename):
+    """
+    Returns the SHA-1 of filename, reading it BUFFER_SIZE bytes at a time
+    """
+    file_hash = hashlib.sha1()
+    input_file = open(filename, 'rb')
+    try:
+        file_data = input_file.read(BUFFER_SIZE)
+        while file_data:
+            file_hash.update(file_data)
+            file_data = input_file.read(BUFFER_SIZE)
+    finally:
+        input_file.close()
+    return file_hash.hexdigest()
+
+def add_manifest_entry(manifest_filename, compressed_filename, decompressed_filename, bytes_written, output_checksum):
+    """
+    Appends an entry for a finished file to manifest_filename, and flushes it to disk.
+    Only call this for outputs that were verified (decompressed with no error message),
+    and that were decompressed from compressed_filename alone.
+    """
+    manifest_entry = get_source_state(compressed_filename)
+    manifest_entry.update({
+        'source': os.path.abspath(compressed_filename),
+        'output': os.path.abspath(decompressed_filename),
+        'output_size': bytes_written,
+        'output_mtime': os.path.getmtime(decompressed_filename),
+        'output_checksum': output_checksum
+    })
+    manifest_file = open(manifest_filename, 'a')
+    try:
+        manifest_file.write(json.dumps(manifest_entry) + '\n')
+        manifest_file.flush()
+        os.fsync(manifest_file.fileno())
+    finally:
+        manifest_file.close()
+
+def is_finished(manifest, compressed_filename):
+    """
+    Returns True if manifest shows that compressed_filename was already decompressed, the
+    compressed file has not changed since, and the output still exists with the same size.
+    If the output's modified time has changed, its SHA-1 must also match the manifest.
+    """
+    manifest_entry = manifest.get(os.path.abspath(compressed_filename))
+    if manifest_entry is None:
+        return False
+    try:
+        source_state = get_source_state(compressed_filename)
+    except (IOError, OSError):
+        return False
+    if any(manifest_entry[k] != v for k, v in source_state.items()):
+        return False
+    try:
+        output_stats = os.stat(manifest_entry['output'])
+        if output_stats.st_size != manifest_entry['output_size']:
+            return False
+        if output_stats.st_mtime == manifest_entry.get('output_mtime'):
+            return True
+        return get_file_checksum(manifest_entry['output']) == manifest_entry['output_checksum']
+    except (IOError, OSError):
+        return False
+
+def get_rate(byte_count, seconds):
+    """
+    Returns the MB/s for byte_count bytes in seconds
+    """
+    return byte_count / float(1024 * 1024) / max(seconds, 0.000001)
+
+def decompress_files(compressed_filenames, worker_count=None, by_block=False, manifest_filename=None):
+    """
+    Decompresses compressed_filenames in a pool of worker_count processes, printing the
+    throughput of each file as it finishes, and of the whole set at the end.
+    Files that are decompressed to the same name (see get_output_groups) are appended into
+    that file in sorted order, by one worker, so no two workers ever write the same output.
+    If by_block is True, then files are decompressed one at a time, with each file's
+    blocks decompressed by the pool (see decompress_file_blocks).
+    If manifest_filename is provided, then files that it shows are already finished are
+    skipped (unless other files are decompressed to the same name), and each file that
+    finishes is added to it, if it was the only file decompressed to its name. Files are only added once the end of
+    their compressed stream was reached and its checksum matched, so truncated files are retried.
+    Returns the number of files that could not be decompressed.
+    """
+    start_time = time.time()
+    total_bytes = 0
+    error_count = 0
+    output_groups = get_output_groups(compressed_filenames)
+    if manifest_filename is not None:
+        manifest = read_manifest(manifest_filename)
+        skipped_groups = [g for g in output_groups if len(g) == 1 and is_finished(manifest, g[0])]
+        for skipped_group in skipped_groups:
+            print('Skipping {0}, which was already decompressed'.format(skipped_group[0]))
+        output_groups = [g for g in output_groups if g not in skipped_groups]
+    # Outputs that several files were appended into are not recorded in the manifest
+    grouped_filenames = set(f for g in output_groups if len(g) > 1 for f in g)
+    pool = Pool(processes=worker_count)
+    try:
+        if by_block is True:
+            results = (r for g in output_groups for r in decompress_group(g, pool))
+        else:
+            results = (r for group_results in pool.imap_unordered(decompress_group, output_groups) for r in group_results)
+        for compressed_filename, decompressed_filename, _, bytes_written, seconds, error_message, output_checksum in results:
+            if error_message is not None:
+                error_count += 1
+                print('Could not decompress {0}!\nError details: {1}'.format(compressed_filename, error_message))
+            else:
+                if manifest_filename is not None and compressed_filename not in grouped_filenames:
+                    add_manifest_entry(manifest_filename, compressed_filename, decompressed_filename, bytes_written, output_checksum)
+                total_bytes += bytes_written
+                print('Decompressed {0} -> {1} ({2:.1f} MB/s)'.format(compressed_filename, decompressed_filename, get_rate(bytes_written, seconds)))
+    finally:
+        pool.close()
+        pool.join()
+
+    elapsed = time.time() - start_time
+    print('Decompressed {0:.1f} MB in {1:.1f}s ({2:.1f} MB/s)'.format(total_bytes / float(1024 * 1024), elapsed, get_rate(total_bytes, elapsed)))
+    return error_count
+
+if __name__ == '__main__':
     DIR = sys.argv[1:]
+    WORKER_COUNT = None
+    if '--workers' in DIR:
+        WORKER_INDEX = DIR.index('--workers')
+        WORKER_COUNT = int(DIR[WORKER_INDEX + 1])
+        DIR = DIR[:WORKER_INDEX] + DIR[WORKER_INDEX + 2:]
+    MANIFEST_FILE = None
+    if '--manifest' in DIR:
+        MANIFEST_INDEX = DIR.index('--manifest')
+        MANIFEST_FILE = DIR[MANIFEST_INDEX + 1]
+        DIR = DIR[:MANIFEST_INDEX] + DIR[MANIFEST_INDEX + 2:]
+    BY_BLOCK = '--blocks' in DIR
+    DIR = [d for d in DIR if d != '--blocks']
+
+    if len(DIR) == 0:
+        print('You must provide a path or file to decompress!')
+        show_help()
+        sys.exit(1)
     # Capture --help, -h, -help
     # I didn't want to support argparse and optparse, so I'm just doing this manually
-    if len(DIR) == 1 and DIR[0].lower().lstrip('-') == 'h' or DIR[0].lower().lstrip('-') == 'help':
+    if len(DIR) == 1 and DIR[0].lower().lstrip('-') in ('h', 'help'):
         show_help()
         sys.exit(0)
+
+    FILES = get_files(DIR)
+    if len(FILES) > 0:
+        sys.exit(1 if decompress_files(sorted(FILES), WORKER_COUNT, BY_BLOCK, MANIFEST_FILE) > 0 else 0)
     else:
-        FILES = get_files(DIR)
-else:
-    print('You must provide a path or file to decompress!')
-    show_help()
-    sys.exit(1)
-
-if len(DIR) > 0:
-    for compressed_filename in DIR:
-        # Remove the .bz2 extension
-        decompressed_filename = compressed_filename[:-4]
-
-        # If a timestamp is appended to the remaining filename, clean it out
-        decompressed_filename = TIMESTAMP_PATTERN.sub('', decompressed_filename)
-
-        print('Decompressing {0} -> {1}'.format(compressed_filename, decompressed_filename))
-        compressed_file = BZ2File(compressed_filename)
-        with open(decompressed_filename, 'wb') as decompressed_file:
-            decompressed_file.write(compressed_file.read())
-        compressed_file.close()
-else:
-    print('No bz2 files were found!')
\ No newline at end of file
+        print('No compressed files were found!')
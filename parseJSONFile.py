@@ -1,37 +1,183 @@
 import csv
+import hashlib
 import json
-import ioHelpers as io
+from multiprocessing import Pool
+import os
 
 INPUT_DIR = 'D:/mnt/data/empyr'
-OFFER_FILES = io.getFiles(searchDirectories = INPUT_DIR, fileExtensions = '*.json')
+OUTPUT_FILE = INPUT_DIR + '/offer_merchants.csv'
+# Number of processes that decode offer files. None uses every CPU.
+WORKER_COUNT = None
+# Number of offer files that are sent to a process at a time
+FILES_PER_TASK = 64
+MERCHANT_COLUMNS = ['name', 'category', 'source']
+# Records the size, modified time, hash, and merchants of each offer file, so
+# that only new or changed files are decoded by updateMerchantCatalog
+MANIFEST_FILE = INPUT_DIR + '/offer_manifest.json'
+INCREMENTAL = True
 
-MERCHANTS = {}
+def parseOfferMerchants(offerBytes, offerFile):
+    """
+    Returns a list of (id, merchant) pairs for the offers in offerBytes, which were read from offerFile.
+    Only the id, name, and primaryCategory fields of each offer are kept.
+    """
+    offersJSON = json.loads(offerBytes.decode('utf-8'))
+    merchants = []
+    for offer in offersJSON['results']:
+        merchants.append((offer['id'], {
+            'name': offer.get('name', '').strip(),
+            'category': offer.get('primaryCategory', '').strip(),
+            'source': offerFile
+        }))
+    return merchants
 
-for offerFile in OFFER_FILES:
+def getOfferMerchants(offerFile):
+    """
+    Decodes offerFile, and returns the file, a list of (id, merchant) pairs for its
+    offers, and an error message (if the file could not be decoded).
+    """
     try:
-        offerDetails = ''.join(open(file = offerFile, mode = 'tr', encoding = 'utf-8').readlines()).strip('\n')
-        offersJSON = json.loads(offerDetails)
-        for offer in offersJSON['results']:
-            MERCHANTS[offer['id']] = {
-                'name': '',
-                'category': '',
-                'source': offerFile
-            }
-
-            if 'name' in offer:
-                MERCHANTS[offer['id']]['name'] = offer['name'].strip()
-
-            if 'primaryCategory' in offer:
-                MERCHANTS[offer['id']]['category'] = offer['primaryCategory'].strip()
-
-    except BaseException as err:
-        print(str(err))
-        pass
-
-with open(INPUT_DIR + '/offer_merchants.csv', 'w') as outputFile:
-    columns = ['name', 'category', 'source']
-    writer = csv.DictWriter(outputFile, fieldnames=columns, restval="", extrasaction='ignore',dialect='excel')
-
-    writer.writeheader()
-    for merchant in MERCHANTS:
-        writer.writerow(MERCHANTS[merchant])
+        with open(file = offerFile, mode = 'rb') as inputFile:
+            return offerFile, parseOfferMerchants(inputFile.read(), offerFile), None
+
+    except Exception as err:
+        return offerFile, [], str(err)
+
+def getFileHash(fileBytes):
+    """
+    Returns the hash that is saved in the manifest for fileBytes
+    """
+    return hashlib.sha1(fileBytes).hexdigest()
+
+def getOfferFileEntry(offerDetails):
+    """
+    Returns the offer file and its manifest entry, which has its size, modified time, hash,
+    and (id, merchant) pairs, along with an error message (if the file could not be decoded).
+    offerDetails is a tuple of the offer file, and its current manifest entry, if it has one.
+    If the file's content has not changed since that entry was made, then it is not decoded again.
+    """
+    offerFile, manifestEntry = offerDetails
+    try:
+        with open(file = offerFile, mode = 'rb') as inputFile:
+            fileStats = os.fstat(inputFile.fileno())
+            offerBytes = inputFile.read()
+        fileEntry = {
+            'size': fileStats.st_size,
+            'mtime': fileStats.st_mtime_ns,
+            'hash': getFileHash(offerBytes)
+        }
+        if manifestEntry is not None and manifestEntry['hash'] == fileEntry['hash']:
+            fileEntry['merchants'] = manifestEntry['merchants']
+        else:
+            fileEntry['merchants'] = parseOfferMerchants(offerBytes, offerFile)
+        return offerFile, fileEntry, None
+
+    except Exception as err:
+        return offerFile, None, str(err)
+
+def getMerchants(offerFiles, workerCount = WORKER_COUNT):
+    """
+    Decodes offerFiles in a pool of workerCount processes, and returns an iterator
+    of merchant dicts as they are found. Each merchant id is only returned once, from
+    the first file (in the order of offerFiles) that has it.
+    """
+    foundIds = set()
+    with Pool(processes = workerCount) as pool:
+        for offerFile, merchants, err in pool.imap(getOfferMerchants, offerFiles, chunksize = FILES_PER_TASK):
+            if err is not None:
+                print('{0}: {1}'.format(offerFile, err))
+            for merchantId, merchant in merchants:
+                if merchantId not in foundIds:
+                    foundIds.add(merchantId)
+                    yield merchant
+
+def writeMerchants(merchants, outputFilename = OUTPUT_FILE):
+    """
+    Writes each of the merchants to outputFilename as soon as it is received,
+    and returns the number of merchants written
+    """
+    merchantCount = 0
+    with open(outputFilename, 'w', newline = '') as outputFile:
+        writer = csv.DictWriter(outputFile, fieldnames=MERCHANT_COLUMNS, restval="", extrasaction='ignore',dialect='excel')
+
+        writer.writeheader()
+        for merchant in merchants:
+            writer.writerow(merchant)
+            merchantCount += 1
+    return merchantCount
+
+def readManifest(manifestFilename = MANIFEST_FILE):
+    """
+    Returns the manifest entries in manifestFilename, keyed by offer file.
+    Returns an empty dict if the manifest does not exist yet.
+    """
+    if os.path.exists(manifestFilename) is False:
+        return {}
+    with open(manifestFilename, 'r', encoding = 'utf-8') as manifestFile:
+        return json.load(manifestFile)['files']
+
+def writeManifest(manifest, manifestFilename = MANIFEST_FILE):
+    """
+    Saves manifest to manifestFilename. A temporary file is written first, so an
+    interrupted run does not leave a partial manifest behind.
+    """
+    tempFilename = manifestFilename + '.tmp'
+    with open(tempFilename, 'w', encoding = 'utf-8') as manifestFile:
+        json.dump({'files': manifest}, manifestFile)
+    os.replace(tempFilename, manifestFilename)
+
+def updateMerchantCatalog(offerFiles, outputFilename = OUTPUT_FILE, manifestFilename = MANIFEST_FILE, workerCount = WORKER_COUNT):
+    """
+    Updates the manifest for offerFiles, and rewrites the merchant catalog in outputFilename from it.
+    Offer files whose size and modified time match the manifest are not read. Other files are hashed,
+    and only decoded if their hash changed. Files that no longer exist are dropped from the manifest.
+    Returns the number of files that were decoded, and the number of merchants written.
+    """
+    offerFiles = list(offerFiles)
+    manifest = readManifest(manifestFilename)
+    updatedManifest = {}
+    changedFiles = []
+    for offerFile in offerFiles:
+        manifestEntry = manifest.get(offerFile)
+        try:
+            fileStats = os.stat(offerFile)
+        except OSError as err:
+            print('{0}: {1}'.format(offerFile, err))
+            continue
+        if manifestEntry is not None and manifestEntry['size'] == fileStats.st_size and manifestEntry['mtime'] == fileStats.st_mtime_ns:
+            updatedManifest[offerFile] = manifestEntry
+        else:
+            changedFiles.append((offerFile, manifestEntry))
+
+    parsedCount = 0
+    if len(changedFiles) > 0:
+        with Pool(processes = workerCount) as pool:
+            for offerFile, fileEntry, err in pool.imap_unordered(getOfferFileEntry, changedFiles, chunksize = FILES_PER_TASK):
+                if err is not None:
+                    print('{0}: {1}'.format(offerFile, err))
+                    continue
+                if manifest.get(offerFile) is None or manifest[offerFile]['hash'] != fileEntry['hash']:
+                    parsedCount += 1
+                updatedManifest[offerFile] = fileEntry
+
+    writeManifest(updatedManifest, manifestFilename)
+
+    foundIds = set()
+    catalog = []
+    for offerFile in offerFiles:
+        for merchantId, merchant in updatedManifest.get(offerFile, {}).get('merchants', []):
+            if merchantId not in foundIds:
+                foundIds.add(merchantId)
+                catalog.append(merchant)
+    return parsedCount, writeMerchants(catalog, outputFilename)
+
+if __name__ == '__main__':
+    import ioHelpers as io
+
+    OFFER_FILES = io.getFiles(searchDirectories = INPUT_DIR, fileExtensions = '*.json')
+    if INCREMENTAL is True:
+        parsedCount, merchantCount = updateMerchantCatalog(OFFER_FILES)
+        print('{0} offer files were decoded'.format(parsedCount))
+    else:
+        merchantCount = writeMerchants(getMerchants(OFFER_FILES))
+    print('{0} merchants were saved to {1}'.format(merchantCount, OUTPUT_FILE))
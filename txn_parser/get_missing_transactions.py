@@ -3,11 +3,14 @@ from builtins import (
          bytes, dict, int, list, object, range, str,
          ascii, chr, hex, input, next, oct, pow, round,
          super, filter, map, zip)
+from bisect import (bisect_left, bisect_right)
 import collections
+import csv
 from datetime import datetime
 import os
 import re
 from functools import partial
+from itertools import chain
 from io import open
 import six
 
@@ -22,6 +25,14 @@ TRACKER_FIELDS = 'merchant_name,merchant_location,city,state,merchant_postal,mer
 EXPORT_FILE = os.path.join(os.path.dirname(__file__), 'bk_download.csv')
 EXPORT_FIELDS = 'posted_status,who_the,transaction_date,fuck_cares,merchant_name,payment_category,transaction_amount'.split(',')
 
+OUTPUT_FILE = os.path.join(os.path.dirname(__file__), 'missing_transactions.csv')
+# When either is set, records can match within this amount, and within this many days
+AMOUNT_TOLERANCE = None
+DATE_WINDOW_DAYS = None
+# When True, the export file is filtered and written one record at a time, and only the
+# tracker's matching values are kept in memory
+STREAM_RECORDS = True
+
 MMDDYYYY_PATTERN = re.compile('(?P<month>1[0-2]|0[1-9])([\\-\\/])?(?P<day>[0-2][0-9]|3[0-1])([\\-\\/])?(?P<year>201\\d)')
 YYYYMMDD_PATTERN = re.compile('(?P<year>201\\d)([\\-\\/])?(?P<month>1[0-2]|0[1-9])([\\-\\/])?(?P<day>[0-2][0-9]|3[0-1])')
 
@@ -134,6 +145,70 @@ def fields_match(record_set, matching_fields, record):
                 return True
     return False
 
+class RecordIndex(object):
+    """
+    A hash index over record_set, which can be probed with records from another
+    set to see if they exist in record_set. Matching follows the same rules as
+    fields_match: matching_fields can be a list of field names, or a dict whose keys
+    are fields in record_set and whose values are the corresponding fields in the
+    probed records. Cleansed field names are used, and values must be equal.
+    Because a probed record may only contain some of the matching_fields, an index
+    is built (once) for each combination of fields that is actually probed.
+    If index_fields (a list of field name lists) is provided, then only those combinations
+    are indexed, in a single pass over record_set, and the records themselves are not kept.
+    This keeps memory to the key values only, so record_set can be a streaming iterator.
+    """
+
+    def __init__(self, record_set, matching_fields, index_fields=None):
+        # type: (Iterable[dict], Union[Sequence[str], Dict[str, str]], Optional[Sequence[Sequence[str]]]) -> None
+        self.matching_fields = matching_fields
+        self.__key_sets__ = {}
+        if index_fields is None:
+            self.records = record_set if is_sequence(record_set) else list(record_set)
+        else:
+            self.records = None
+            key_field_list = [tuple(sorted(key_fields)) for key_fields in index_fields]
+            stripped_field_list = [get_stripped_string(key_fields) for key_fields in key_field_list]
+            key_sets = [self.__key_sets__.setdefault(key_fields, set()) for key_fields in key_field_list]
+            for r in record_set:
+                for key_set, stripped_fields in zip(key_sets, stripped_field_list):
+                    key_set.add(tuple(r[f] for f in stripped_fields))
+
+    def __get_key_set__(self, key_fields):
+        # type: (Tuple[str]) -> set
+        """
+        Returns the set of value tuples in the index for key_fields, building it if needed
+        """
+        if key_fields not in self.__key_sets__:
+            if self.records is None:
+                raise AttributeError('The index was not built for these fields!\nProvided fields: {0}'.format(', '.join(key_fields)))
+            stripped_fields = get_stripped_string(key_fields)
+            self.__key_sets__[key_fields] = set(
+                tuple(r[f] for f in stripped_fields) for r in self.records
+            )
+        return self.__key_sets__[key_fields]
+
+    def get_record_key(self, record):
+        # type: (dict) -> Tuple[Tuple[str], tuple]
+        """
+        Returns the matching field names found in record, and their values, as a pair of tuples
+        """
+        record_values = get_record_values_matching_keys(record, self.matching_fields)
+        key_fields = tuple(sorted(record_values))
+        return key_fields, tuple(record_values[k] for k in key_fields)
+
+    def contains(self, record):
+        # type: (dict) -> bool
+        """
+        Returns True if record is in the index
+        """
+        key_fields, key_values = self.get_record_key(record)
+        if len(key_fields) == 0:
+            return False
+        return key_values in self.__get_key_set__(key_fields)
+
+    __contains__ = contains
+
 def __value_matches__(matching_obj, value):
     # type: (Union[collections.Sequence, Any], Any) -> bool
     """
@@ -252,6 +327,187 @@ def parse_transaction_record(txn_record):
 
     return return_record
 
+ToleranceMatch = collections.namedtuple('ToleranceMatch', ['rule', 'record'])
+
+class ToleranceIndex(object):
+    """
+    An index over parsed transaction records (see parse_transaction_record) that
+    matches records whose amounts are within amount_tolerance of each other, and whose
+    dates are within date_window days of each other (if date_window is provided).
+    Records are bucketed by the cleansed values of bucket_fields, which can be shortened
+    to name_length characters so that merchant name variants fall in the same bucket.
+    Each bucket is sorted by amount and then date, so a probe only looks at the records in
+    its amount window, and (if date_window is provided) only at the records of each amount
+    that are in its date window, instead of scanning every record.
+    """
+
+    def __init__(self, record_set, bucket_fields=('merchant_name',), amount_tolerance=0.0, date_window=None,
+                 name_length=None, amount_field='transaction_amount', date_field='transaction_date'):
+        # type: (Iterable[dict], Sequence[str], float, Optional[int], Optional[int], str, str) -> None
+        self.bucket_fields = get_stripped_string(list(bucket_fields))
+        self.amount_tolerance = abs(amount_tolerance or 0.0)
+        self.date_window = date_window
+        self.name_length = name_length
+        self.amount_field = get_stripped_string(amount_field)
+        self.date_field = get_stripped_string(date_field)
+
+        buckets = {}
+        for r in record_set:
+            buckets.setdefault(self.get_bucket_key(r), []).append((r[self.amount_field], self.get_date_key(r), r))
+        self.__buckets__ = {}
+        for bucket_key, bucket_records in buckets.items():
+            bucket_records.sort(key=lambda a_d_r: a_d_r[:2])
+            self.__buckets__[bucket_key] = tuple([list(v) for v in zip(*bucket_records)])
+
+    def get_bucket_key(self, record):
+        # type: (dict) -> tuple
+        """
+        Returns the cleansed (and possibly shortened) values of the bucket fields in record
+        """
+        return tuple(get_stripped_string(str(record.get(f, '')))[:self.name_length] for f in self.bucket_fields)
+
+    def get_date_key(self, record):
+        # type: (dict) -> int
+        """
+        Returns the day number of the date in record, or 0 if it does not have a parsed date
+        """
+        record_date = record.get(self.date_field)
+        return record_date.toordinal() if isinstance(record_date, datetime) else 0
+
+    def get_match_rule(self, record, candidate):
+        # type: (dict, dict) -> Optional[str]
+        """
+        Returns the name of the rule which matched record to candidate, or None if
+        the candidate's date is outside of the date window.
+        Rules are exact, or any of fuzzy_name, amount_tolerance, and date_window joined by '+'.
+        """
+        rules = []
+        if any(record.get(f) != candidate.get(f) for f in self.bucket_fields):
+            rules.append('fuzzy_name')
+        if record[self.amount_field] != candidate[self.amount_field]:
+            rules.append('amount_tolerance')
+        if self.date_window is not None:
+            record_date = record.get(self.date_field)
+            candidate_date = candidate.get(self.date_field)
+            if not isinstance(record_date, datetime) or not isinstance(candidate_date, datetime):
+                return None
+            if abs((record_date - candidate_date).days) > self.date_window:
+                return None
+            if record_date != candidate_date:
+                rules.append('date_window')
+        return '+'.join(rules) if len(rules) > 0 else 'exact'
+
+    def find_match(self, record):
+        # type: (dict) -> Optional[ToleranceMatch]
+        """
+        Returns the closest matching record in the index, along with the rule that matched it,
+        as a ToleranceMatch. An exact match is preferred, then the one which needed the fewest rules,
+        then the one closest in amount, and then the one closest in date.
+        Returns None if no record matches.
+        """
+        bucket = self.__buckets__.get(self.get_bucket_key(record))
+        if bucket is None:
+            return None
+        amounts, date_keys, records = bucket
+        amount = record[self.amount_field]
+        date_key = self.get_date_key(record)
+        if self.date_window is not None and date_key == 0:
+            return None
+        best_match = None
+        best_rank = None
+        # Allow for float rounding at the edges of the window
+        max_amount = amount + self.amount_tolerance + 1e-9
+        amount_start = bisect_left(amounts, amount - self.amount_tolerance - 1e-9)
+        while amount_start < len(amounts) and amounts[amount_start] <= max_amount:
+            # The records with this amount, which are sorted by date
+            amount_end = bisect_right(amounts, amounts[amount_start], amount_start)
+            if self.date_window is None:
+                candidate_start, candidate_end = amount_start, amount_end
+            else:
+                candidate_start = bisect_left(date_keys, date_key - self.date_window, amount_start, amount_end)
+                candidate_end = bisect_right(date_keys, date_key + self.date_window, candidate_start, amount_end)
+            for i in range(candidate_start, candidate_end):
+                rule = self.get_match_rule(record, records[i])
+                if rule == 'exact':
+                    return ToleranceMatch(rule, records[i])
+                if rule is None:
+                    continue
+                rank = (rule.count('+'), abs(amounts[i] - amount), abs(date_keys[i] - date_key))
+                if best_rank is None or rank < best_rank:
+                    best_match, best_rank = ToleranceMatch(rule, records[i]), rank
+            amount_start = amount_end
+        return best_match
+
+    def contains(self, record):
+        # type: (dict) -> bool
+        """
+        Returns True if a record in the index matches record
+        """
+        return self.find_match(record) is not None
+
+    __contains__ = contains
+
+def get_probe_fields(matching_fields, field_names):
+    # type: (Union[Sequence[str], Dict[str, str]], Sequence[str]) -> List[str]
+    """
+    Returns the keys of matching_fields that will be found in a parsed record
+    with the provided field_names. This can be passed to RecordIndex as one of
+    its index_fields.
+    """
+    return list(get_record_values_matching_keys(dict.fromkeys(get_stripped_string(field_names)), matching_fields))
+
+def write_missing_records(record_index, filename, field_names, output_filename, record_filter=None, delimiter=','):
+    # type: (RecordIndex, str, Sequence[str], str, Optional[Callable], str) -> int
+    """
+    Reads filename one line at a time, and writes each record that is not in
+    record_index (and passes record_filter, if provided) to output_filename,
+    without holding the file's records in memory. Records are parsed by a csv.reader, so
+    quoted values can contain the delimiter or newlines, and each record is written exactly as
+    it was read (all of its lines). The output starts with the file's header row, or
+    field_names if the file does not have one. Blank lines are skipped.
+    The number of records written (not counting the header) is returned.
+    """
+    header_line = delimiter.join(field_names)
+    written_count = 0
+    with open(output_filename, mode='wt', encoding='utf-8') as output_file:
+        file_lines = iter(read_file(filename=filename))
+        for first_line in file_lines:
+            if first_line.startswith('\ufeff'):
+                first_line = first_line[1:]
+            if first_line.startswith(header_line) is True:
+                header_line = first_line.rstrip('\r\n')
+            else:
+                file_lines = chain([first_line], file_lines)
+            break
+        output_file.write(header_line + '\n')
+
+        # The lines that the csv.reader has read for the record that it is parsing
+        record_lines = []
+        def iter_record_lines():
+            for file_line in file_lines:
+                record_lines.append(file_line)
+                yield file_line
+
+        for csv_record in csv.reader(iter_record_lines(), delimiter=delimiter):
+            raw_record = ''.join(record_lines)
+            del record_lines[:]
+            if len(csv_record) == 0:
+                continue
+            r = parse_transaction_record(dict(zip(field_names, csv_record)))
+            if record_filter is not None and record_filter(r) is False:
+                continue
+            if record_index.contains(r) is False:
+                output_file.write(raw_record if raw_record.endswith('\n') else raw_record + '\n')
+                written_count += 1
+    return written_count
+
+def is_new_debit(txn_record):
+    # type: (dict) -> bool
+    """
+    Returns True if the parsed txn_record has a negative transaction amount
+    """
+    return txn_record[get_stripped_string('transaction_amount')] < 0
+
 
 matching_fields = [
     'transaction_amount',
@@ -259,15 +515,25 @@ matching_fields = [
     'merchant_id'
 ]
 
-submitted_records = [parse_transaction_record(r) for r in read_delimited_file(TRACKER_FILE, field_names=TRACKER_FIELDS)]
+if __name__ == '__main__' and STREAM_RECORDS is True:
+    tracker_records = (parse_transaction_record(r) for r in read_delimited_file(TRACKER_FILE, field_names=TRACKER_FIELDS))
+    if AMOUNT_TOLERANCE is not None or DATE_WINDOW_DAYS is not None:
+        submitted_index = ToleranceIndex(tracker_records, amount_tolerance=AMOUNT_TOLERANCE, date_window=DATE_WINDOW_DAYS)
+    else:
+        submitted_index = RecordIndex(tracker_records, matching_fields, index_fields=[get_probe_fields(matching_fields, EXPORT_FIELDS)])
+    missing_count = write_missing_records(submitted_index, EXPORT_FILE, EXPORT_FIELDS, OUTPUT_FILE, record_filter=is_new_debit)
+    print('{0} missing records were saved to {1}'.format(missing_count, OUTPUT_FILE))
+
+elif __name__ == '__main__':
+    submitted_records = [parse_transaction_record(r) for r in read_delimited_file(TRACKER_FILE, field_names=TRACKER_FIELDS)]
 
-records_match = partial(fields_match, submitted_records, matching_fields)
+    submitted_index = RecordIndex(submitted_records, matching_fields)
 
-stored_records = [parse_transaction_record(r) for r in read_delimited_file(EXPORT_FILE, field_names=EXPORT_FIELDS)]
-new_records = []
-for r in stored_records:
-    if r[get_stripped_string('transaction_amount')] < 0 and records_match(r) is False:
-        new_records.append(r)
+    stored_records = [parse_transaction_record(r) for r in read_delimited_file(EXPORT_FILE, field_names=EXPORT_FIELDS)]
+    new_records = []
+    for r in stored_records:
+        if is_new_debit(r) and submitted_index.contains(r) is False:
+            new_records.append(r)
 
-for r in new_records:
+    for r in new_records:
         print(r)
\ No newline at end of file
@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import (absolute_import, division, generators, nested_scopes, print_function, unicode_literals, with_statement)
+from builtins import (bytes, dict, int, list, object, range, str, ascii, chr, hex, input, next, oct, open, pow, round, super, filter, map, zip)
+import bz2
+from collections import namedtuple
+from datetime import datetime
+import gzip
+import hashlib
+import os
+from pathlib import Path
+import shutil
+import sqlite3
+import tempfile
+import time
+from typing import (Dict, List, Tuple, Union)
+try:
+    import lzma
+except ImportError:
+    lzma = None
+
+import futils
+
+"""
+Provides a content-addressed store for file backups. Each distinct file content is
+stored once, named by its hash, and a catalog records which content each original
+path had at each backup time.
+"""
+
+PATH_LIKE = futils.PATH_LIKE
+DEFAULT_STORE_DIR = '.backups'
+BACKUP_HASH_NAME = 'sha256'
+CATALOG_SCHEMA = """
+CREATE TABLE IF NOT EXISTS backups (
+    path TEXT NOT NULL,
+    backup_time REAL NOT NULL,
+    file_hash TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mode INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS backups_by_path ON backups (path, backup_time);
+"""
+COMPRESSION_OPENERS = {
+    None: open,
+    'gzip': gzip.open,
+    'bz2': bz2.open
+}
+COMPRESSION_EXTENSIONS = {
+    None: '',
+    'gzip': '.gz',
+    'bz2': '.bz2'
+}
+if lzma is not None:
+    COMPRESSION_OPENERS['xz'] = lzma.open
+    COMPRESSION_EXTENSIONS['xz'] = '.xz'
+
+BackupEntry = namedtuple('BackupEntry', ['path', 'backup_time', 'file_hash', 'size', 'mode'])
+
+def get_timestamp(backup_time:Union[float, datetime]) -> float:
+    """
+    Returns backup_time as seconds since the epoch
+    """
+    return backup_time.timestamp() if isinstance(backup_time, datetime) else float(backup_time)
+
+class BackupStore(object):
+    """
+    Stores backups of files under store_dir. The contents are kept in store_dir/objects, once per
+    distinct content (by its BACKUP_HASH_NAME hash), and compressed with compression ('gzip',
+    'bz2', 'xz' or None). Contents that are already in the store are never written again, even
+    if they were stored with a different compression. The catalog (store_dir/catalog.sqlite)
+    records the original path, time, hash, size and permissions of each backup.
+    """
+    def __init__(self, store_dir:PATH_LIKE=DEFAULT_STORE_DIR, compression:str='gzip'):
+        if compression not in COMPRESSION_OPENERS:
+            raise AttributeError('The provided compression is not supported!\nProvided value: {0}'.format(compression))
+        self.store_dir = Path(store_dir)
+        self.objects_dir = self.store_dir.joinpath('objects')
+        self.compression = compression
+        self.objects_dir.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(str(self.store_dir.joinpath('catalog.sqlite')))
+        self.connection.executescript(CATALOG_SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """
+        Closes the catalog
+        """
+        self.connection.close()
+
+    def get_object_filename(self, file_hash:str) -> Path:
+        """
+        Returns the filename of the stored content for file_hash, or None if it is not in the store.
+        """
+        object_dir = self.objects_dir.joinpath(file_hash[:2])
+        for compression_extension in COMPRESSION_EXTENSIONS.values():
+            object_filename = object_dir.joinpath(file_hash + compression_extension)
+            if object_filename.exists():
+                return object_filename
+        return None
+
+    def __add_object__(self, filename:str) -> Tuple[str, int]:
+        """
+        Writes the contents of filename to a temporary file in the store, hashing them as they are
+        read, and renames it to the object name for that hash (unless the store already has it).
+        Returns the hash and size of the contents that were read, so the stored object always
+        matches its name, even if filename changes while it is being read.
+        """
+        object_hash = hashlib.new(BACKUP_HASH_NAME)
+        object_size = 0
+        temp_handle, temp_filename = tempfile.mkstemp(dir=str(self.objects_dir), suffix='.partial')
+        os.close(temp_handle)
+        try:
+            with open(filename, 'rb') as input_file:
+                with COMPRESSION_OPENERS[self.compression](temp_filename, 'wb') as object_file:
+                    file_data = input_file.read(futils.DEFAULT_HASH_CHUNK_SIZE)
+                    while len(file_data) > 0:
+                        object_file.write(file_data)
+                        object_hash.update(file_data)
+                        object_size += len(file_data)
+                        file_data = input_file.read(futils.DEFAULT_HASH_CHUNK_SIZE)
+            file_hash = object_hash.hexdigest()
+            if self.get_object_filename(file_hash) is None:
+                object_filename = self.objects_dir.joinpath(file_hash[:2], file_hash + COMPRESSION_EXTENSIONS[self.compression])
+                object_filename.parent.mkdir(exist_ok=True)
+                os.replace(temp_filename, str(object_filename))
+        finally:
+            if os.path.exists(temp_filename):
+                os.remove(temp_filename)
+        return file_hash, object_size
+
+    def backup_file(self, filename:PATH_LIKE) -> BackupEntry:
+        """
+        Adds a backup of filename to the store, and returns its BackupEntry. The file is hashed first,
+        and its contents are only written if the store does not have them yet. Contents that are
+        written are hashed again as they are stored, and recorded under that hash.
+        """
+        provided_filename = os.path.abspath(str(filename))
+        try:
+            file_stat = os.stat(provided_filename)
+            file_hash = futils.get_file_hash(provided_filename, BACKUP_HASH_NAME)
+            file_size = file_stat.st_size
+            if self.get_object_filename(file_hash) is None:
+                file_hash, file_size = self.__add_object__(provided_filename)
+        except FileNotFoundError:
+            raise OSError('The provided file cannot be found!\nProvided file: {0}'.format(str(filename)))
+
+        backup_entry = BackupEntry(Path(provided_filename), time.time(), file_hash, file_size, file_stat.st_mode & 0o7777)
+        with self.connection:
+            self.connection.execute('INSERT INTO backups VALUES (?, ?, ?, ?, ?)', (
+                provided_filename, backup_entry.backup_time, file_hash, backup_entry.size, backup_entry.mode
+            ))
+        return backup_entry
+
+    def get_backups(self, filename:PATH_LIKE=None) -> List[BackupEntry]:
+        """
+        Returns the backups of filename (or of every file, if filename is None), oldest first.
+        """
+        if filename is None:
+            backup_rows = self.connection.execute('SELECT * FROM backups ORDER BY path, backup_time')
+        else:
+            backup_rows = self.connection.execute('SELECT * FROM backups WHERE path = ? ORDER BY backup_time',
+                                                  (os.path.abspath(str(filename)),))
+        return [BackupEntry(Path(r[0]), *r[1:]) for r in backup_rows]
+
+    def get_backup(self, filename:PATH_LIKE, backup_time:Union[float, datetime]=None) -> BackupEntry:
+        """
+        Returns the latest backup of filename that was made at or before backup_time (seconds since
+        the epoch, or a datetime), or the latest backup if backup_time is None.
+        """
+        backup_row = self.connection.execute(
+            'SELECT * FROM backups WHERE path = ? AND backup_time <= ? ORDER BY backup_time DESC LIMIT 1',
+            (os.path.abspath(str(filename)), float('inf') if backup_time is None else get_timestamp(backup_time))
+        ).fetchone()
+        if backup_row is None:
+            raise AttributeError('No backup of the provided file was found!\nProvided file: {0}'.format(str(filename)))
+        return BackupEntry(Path(backup_row[0]), *backup_row[1:])
+
+    def restore_file(self, filename:PATH_LIKE, backup_time:Union[float, datetime]=None, destination_filename:PATH_LIKE=None) -> Path:
+        """
+        Restores the backup of filename from backup_time (see get_backup) to destination_filename,
+        or to filename if destination_filename is None, and returns the restored file's Path.
+        The file is replaced in one step, so it is never left partly written.
+        """
+        backup_entry = self.get_backup(filename, backup_time)
+        object_filename = self.get_object_filename(backup_entry.file_hash)
+        if object_filename is None:
+            raise OSError('The backup contents are missing from the store!\nProvided file: {0}'.format(str(filename)))
+        object_compression = {e: c for c, e in COMPRESSION_EXTENSIONS.items()}[object_filename.suffix]
+
+        output_filename = str(backup_entry.path if destination_filename is None else Path(destination_filename))
+        temp_filename = '{0}.{1}.partial'.format(output_filename, os.getpid())
+        try:
+            with COMPRESSION_OPENERS[object_compression](str(object_filename), 'rb') as object_file:
+                with open(temp_filename, 'wb') as output_file:
+                    shutil.copyfileobj(object_file, output_file, futils.DEFAULT_HASH_CHUNK_SIZE)
+            os.chmod(temp_filename, backup_entry.mode)
+            os.replace(temp_filename, output_filename)
+        except BaseException:
+            if os.path.exists(temp_filename):
+                os.remove(temp_filename)
+            raise
+        return Path(output_filename)
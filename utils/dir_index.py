@@ -0,0 +1,251 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import (absolute_import, division, generators, nested_scopes, print_function, unicode_literals, with_statement)
+from builtins import (bytes, dict, int, list, object, range, str, ascii, chr, hex, input, next, oct, open, pow, round, super, filter, map, zip)
+import os
+from pathlib import Path
+import sqlite3
+from typing import (Dict, Iterable, Iterator, List, Set, Tuple, Union)
+
+import futils
+
+"""
+Provides a persistent, SQLite-backed index of directory trees, so that repeated
+listings of mostly unchanged trees only need to stat each directory.
+"""
+
+PATH_LIKE = futils.PATH_LIKE
+PATH_LIKE_ITERABLE = futils.PATH_LIKE_ITERABLE
+DEFAULT_INDEX_FILE = '.futils_index.sqlite'
+INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS dirs (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL,
+    inode INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS entries (
+    dir TEXT NOT NULL,
+    name TEXT NOT NULL,
+    is_dir INTEGER NOT NULL,
+    is_symlink INTEGER NOT NULL,
+    size INTEGER,
+    mtime_ns INTEGER,
+    inode INTEGER,
+    PRIMARY KEY (dir, name)
+);
+"""
+
+def get_subtree_bounds(dir_path:str) -> Tuple[str, str]:
+    """
+    Returns a (low, high) pair of strings, where every path under dir_path sorts
+    low <= path < high. This lets SQLite use the primary key for subtree queries.
+    """
+    dir_prefix = dir_path.rstrip(os.sep) + os.sep
+    return dir_prefix, dir_prefix[:-1] + chr(ord(os.sep) + 1)
+
+class DirectoryIndex(object):
+    """
+    Stores the entries (name, size, mtime and inode) of each directory under the indexed roots
+    in a SQLite database. refresh only reads the directories whose mtime or inode changed since
+    they were last read, and reuses the stored entries for the rest.
+    Since a directory's mtime only changes when entries are added, removed or renamed, the size
+    and mtime of files that were modified in place are only updated when their directory is read
+    again, or when refresh is called with check_files=True.
+    """
+    def __init__(self, index_filename:PATH_LIKE=DEFAULT_INDEX_FILE):
+        self.index_filename = str(index_filename)
+        self.connection = sqlite3.connect(self.index_filename)
+        self.connection.executescript(INDEX_SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """
+        Closes the index database
+        """
+        self.connection.close()
+
+    def __get_subtree__(self, dir_path:str, table_name:str, column_names:str) -> List[tuple]:
+        """
+        Returns the rows from table_name for dir_path and every directory below it.
+        """
+        key_name = 'path' if table_name == 'dirs' else 'dir'
+        low, high = get_subtree_bounds(dir_path)
+        return self.connection.execute(
+            'SELECT {0} FROM {1} WHERE {2} = ? OR ({2} >= ? AND {2} < ?)'.format(column_names, table_name, key_name),
+            (dir_path, low, high)
+        ).fetchall()
+
+    def __remove_subtree__(self, dir_path:str):
+        """
+        Removes dir_path, and everything below it, from the index.
+        """
+        low, high = get_subtree_bounds(dir_path)
+        self.connection.execute('DELETE FROM dirs WHERE path = ? OR (path >= ? AND path < ?)', (dir_path, low, high))
+        self.connection.execute('DELETE FROM entries WHERE dir = ? OR (dir >= ? AND dir < ?)', (dir_path, low, high))
+
+    def __read_directory__(self, dir_path:str, dir_stat:os.stat_result, exclusions:List[str]) -> List[str]:
+        """
+        Reads dir_path, replaces its stored entries, and returns the names of its child directories.
+        """
+        entry_rows = []
+        try:
+            with os.scandir(dir_path) as dir_entries:
+                for dir_entry in dir_entries:
+                    if len(exclusions) > 0 and any(e in dir_entry.path for e in exclusions):
+                        continue
+                    try:
+                        is_symlink = dir_entry.is_symlink()
+                        is_dir = dir_entry.is_dir()
+                        entry_stat = dir_entry.stat(follow_symlinks=False)
+                    except OSError:
+                        continue
+                    entry_rows.append((dir_path, dir_entry.name, int(is_dir), int(is_symlink), entry_stat.st_size,
+                                       entry_stat.st_mtime_ns, entry_stat.st_ino))
+        except OSError:
+            pass
+        self.connection.execute('DELETE FROM entries WHERE dir = ?', (dir_path,))
+        self.connection.executemany('INSERT INTO entries VALUES (?, ?, ?, ?, ?, ?, ?)', entry_rows)
+        self.connection.execute('INSERT OR REPLACE INTO dirs VALUES (?, ?, ?)', (dir_path, dir_stat.st_mtime_ns, dir_stat.st_ino))
+        return [r[1] for r in entry_rows if r[2] == 1 and r[3] == 0]
+
+    def __update_file_stats__(self, dir_path:str):
+        """
+        Updates the size and mtime of the stored files in dir_path, without reading the directory.
+        """
+        file_rows = self.connection.execute('SELECT name FROM entries WHERE dir = ? AND is_dir = 0', (dir_path,)).fetchall()
+        for file_name, in file_rows:
+            try:
+                file_stat = os.stat(os.path.join(dir_path, file_name), follow_symlinks=False)
+            except OSError:
+                self.connection.execute('DELETE FROM entries WHERE dir = ? AND name = ?', (dir_path, file_name))
+                continue
+            self.connection.execute('UPDATE entries SET size = ?, mtime_ns = ?, inode = ? WHERE dir = ? AND name = ?',
+                                    (file_stat.st_size, file_stat.st_mtime_ns, file_stat.st_ino, dir_path, file_name))
+
+    def refresh(self, directory:Union[PATH_LIKE, PATH_LIKE_ITERABLE], exclusion_list:List[PATH_LIKE]=None, check_files:bool=False,
+                recursive:bool=True) -> int:
+        """
+        Brings the index up to date for the given directory or list of directories, and returns the
+        number of directories that had to be read. Directories whose path contains an item in
+        exclusion_list are not indexed. Symlinked directories are stored, but not descended into.
+        If recursive is False, only the given directories are read, and not the directories below them.
+        If check_files is True, the files in unchanged directories are also stat'ed, so that files
+        that were modified in place have the correct size and mtime.
+        """
+        directories = directory if futils.is_iterable(directory) else [directory]
+        exclusions = [str(e) for e in exclusion_list or []]
+        read_count = 0
+
+        with self.connection:
+            for this_directory in directories:
+                root_dir = os.path.abspath(str(this_directory))
+                known_dirs = {r[0]: (r[1], r[2]) for r in self.__get_subtree__(root_dir, 'dirs', 'path, mtime_ns, inode')}
+                child_dirs = {}
+                linked_dirs = {}
+                for dir_path, dir_name, is_symlink in self.connection.execute(
+                    'SELECT dir, name, is_symlink FROM entries WHERE is_dir = 1 AND (dir = ? OR (dir >= ? AND dir < ?))',
+                    (root_dir,) + get_subtree_bounds(root_dir)
+                ):
+                    (linked_dirs if is_symlink == 1 else child_dirs).setdefault(dir_path, []).append(dir_name)
+
+                pending_dirs = [root_dir]
+                while len(pending_dirs) > 0:
+                    dir_path = pending_dirs.pop()
+                    try:
+                        dir_stat = os.stat(dir_path)
+                    except OSError:
+                        self.__remove_subtree__(dir_path)
+                        continue
+                    if known_dirs.get(dir_path) == (dir_stat.st_mtime_ns, dir_stat.st_ino):
+                        dir_names = child_dirs.get(dir_path, [])
+                        if check_files is True:
+                            self.__update_file_stats__(dir_path)
+                    else:
+                        read_count += 1
+                        dir_names = self.__read_directory__(dir_path, dir_stat, exclusions)
+                        linked_names = [r[0] for r in self.connection.execute(
+                            'SELECT name FROM entries WHERE dir = ? AND is_dir = 1 AND is_symlink = 1', (dir_path,)
+                        )]
+                        # Drop the subtrees of directories (and of symlinked directories, which get_files
+                        # can index one level of) that were removed or renamed
+                        for removed_name in set(child_dirs.get(dir_path, []) + linked_dirs.get(dir_path, [])).difference(dir_names, linked_names):
+                            self.__remove_subtree__(os.path.join(dir_path, removed_name))
+                    if recursive is True:
+                        pending_dirs += [os.path.join(dir_path, n) for n in dir_names]
+        return read_count
+
+    def iter_entries(self, directory:Union[PATH_LIKE, PATH_LIKE_ITERABLE], file_mask:str=None, recursive=True,
+                     exclusion_list:List[PATH_LIKE]=None, include_files:bool=True, include_dirs:bool=True,
+                     include_symlinks:bool=True) -> Iterator[Tuple[Path, int, int, int]]:
+        """
+        Yields a (path, size, mtime_ns, inode) tuple for each stored entry in the given directory or list
+        of directories, without touching the file system. The paths start with the provided directory,
+        the same as Path.glob. Call refresh first to make sure the index is up to date.
+        If recursive is True, entries below symlinked directories are not returned, even if they
+        are in the index, the same as Path.glob('**/*').
+        """
+        directories = directory if futils.is_iterable(directory) else [directory]
+        name_matches = futils.__get_name_matcher__(file_mask)
+        exclusions = [str(e) for e in exclusion_list or []]
+
+        for this_directory in directories:
+            provided_path = Path(this_directory)
+            root_dir = os.path.abspath(str(this_directory))
+            if recursive is True:
+                entry_rows = self.__get_subtree__(root_dir, 'entries', 'dir, name, is_dir, is_symlink, size, mtime_ns, inode')
+            else:
+                entry_rows = self.connection.execute(
+                    'SELECT dir, name, is_dir, is_symlink, size, mtime_ns, inode FROM entries WHERE dir = ?', (root_dir,)
+                ).fetchall()
+            linked_dirs = [os.path.join(r[0], r[1]) for r in entry_rows if r[2] == 1 and r[3] == 1] if recursive is True else []
+            dir_prefixes = {}
+            for dir_path, name, is_dir, is_symlink, size, mtime_ns, inode in entry_rows:
+                if (is_dir == 1 and include_dirs is False) or (is_dir == 0 and include_files is False):
+                    continue
+                if is_symlink == 1 and include_symlinks is False:
+                    continue
+                if name_matches(name) is False:
+                    continue
+                if dir_path not in dir_prefixes:
+                    is_linked = any(dir_path == l or dir_path.startswith(l + os.sep) for l in linked_dirs)
+                    dir_prefixes[dir_path] = None if is_linked else str(provided_path.joinpath(os.path.relpath(dir_path, root_dir)))
+                dir_prefix = dir_prefixes[dir_path]
+                if dir_prefix is None:
+                    continue
+                entry_path = os.path.join(dir_prefix, name)
+                if len(exclusions) > 0 and any(e in entry_path for e in exclusions):
+                    continue
+                yield Path(entry_path), size, mtime_ns, inode
+
+    def get_files(self, directory:Union[PATH_LIKE, PATH_LIKE_ITERABLE], file_mask:str=None, recursive=True,
+                  exclusion_list:List[PATH_LIKE]=None, refresh:bool=True) -> PATH_LIKE_ITERABLE:
+        """
+        Returns the same paths as futils.get_files, answered from the index. If refresh is True,
+        the changed directories are read first.
+        If recursive is False, the files one directory down are returned, including the files in
+        symlinked directories, the same as Path.glob('*/file_mask'). Since refresh does not descend
+        into symlinked directories, those are read (one level only) here, if refresh is True.
+        """
+        if refresh is True:
+            self.refresh(directory)
+        if recursive is False:
+            # Path.glob('*/file_mask') matches the files one directory down
+            directory = self.get_dirs(directory, include_symlinks=True, refresh=False)
+            if refresh is True:
+                self.refresh([d for d in directory if d.is_symlink()], recursive=False)
+        return [e[0] for e in self.iter_entries(directory, file_mask, recursive, exclusion_list)]
+
+    def get_dirs(self, directory:Union[PATH_LIKE, PATH_LIKE_ITERABLE], recursive=False, include_symlinks=False,
+                 refresh:bool=True) -> PATH_LIKE_ITERABLE:
+        """
+        Returns the same directories as futils.get_dirs, answered from the index. If refresh is True,
+        the changed directories are read first.
+        """
+        if refresh is True:
+            self.refresh(directory)
+        return [e[0] for e in self.iter_entries(directory, None, recursive, include_files=False, include_symlinks=include_symlinks)]
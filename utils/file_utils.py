@@ -3,9 +3,18 @@ from builtins import (
          bytes, dict, int, list, object, range, str,
          ascii, chr, hex, input, next, oct, pow, round,
          super, filter, map, zip)
+from array import array
+import ast
 import collections
+import csv
 from functools import partial
-from io import open
+from itertools import (chain, compress, groupby, islice)
+from io import (BytesIO, StringIO, TextIOWrapper, open)
+import json
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+import os
+import re
 import six
 
 try:
@@ -17,6 +26,21 @@ except ImportError:
 A set of functions used to read files
 """
 
+# Number of characters that read_file_blocks reads at a time
+DEFAULT_BLOCK_SIZE = 1024 * 1024
+# Approximate number of bytes that each process parses at a time in read_delimited_file_parallel
+DEFAULT_CHUNK_SIZE = 32 * 1024 * 1024
+# Number of records in each batch from read_delimited_batches
+DEFAULT_BATCH_SIZE = 10000
+# Number of characters that JsonStreamReader reads at a time
+DEFAULT_JSON_READ_SIZE = 64 * 1024
+# Number of files that are read at once by the *_parallel file readers
+DEFAULT_FILE_WORKERS = 8
+# Number of results that each worker can have waiting to be consumed, in the *_parallel readers
+PENDING_RESULTS_PER_WORKER = 2
+# Values of these types are never iterable, so compiled match functions can compare them directly
+SCALAR_TYPES = frozenset(list(six.string_types) + [str, int, float, bool, type(None)])
+
 def is_iterable(obj):
     # type: (Any) -> bool
     """
@@ -27,6 +51,13 @@ def is_iterable(obj):
     else:
         return True
 
+def is_str(obj):
+    # type: (Any) -> bool
+    """
+    Returns True if obj is a string
+    """
+    return isinstance(obj, six.string_types)
+
 def is_callable(obj):
     # type: (Any) -> bool
     """
@@ -116,6 +147,108 @@ def __get_match_function__(match_criteria):
 
     return m_func
 
+def __get_membership_test__(values):
+    # type: (Iterable[Any]) -> Callable
+    """
+    Returns a function that tests if a value is in values, using a set if the values
+    can be hashed, and the values themselves if they can't
+    """
+    try:
+        value_set = frozenset(values)
+    except TypeError:
+        return lambda v: v in values
+
+    def is_member(value):
+        try:
+            return value in value_set
+        except TypeError:
+            return value in values
+    return is_member
+
+def __compile_value_match__(match_value):
+    # type: (Any) -> Callable
+    """
+    Returns a function that takes a record value, and returns the same result
+    as __value_matches__(record_value, match_value). The checks that only depend on
+    match_value are done once, here, instead of for every record value.
+    """
+    if is_iterable(match_value):
+        is_member = __get_membership_test__(match_value)
+
+        def value_matches(record_value):
+            if record_value.__class__ in SCALAR_TYPES or not is_iterable(record_value):
+                return is_member(record_value)
+            return any(is_member(v) for v in record_value)
+    else:
+        def value_matches(record_value):
+            if record_value.__class__ in SCALAR_TYPES or not is_iterable(record_value):
+                return record_value == match_value
+            return match_value in record_value
+
+    return value_matches
+
+def __compile_column_match__(match_value):
+    # type: (Any) -> Callable
+    """
+    Returns a function that takes a column of record values (see read_delimited_batches),
+    and returns a list with the result of __value_matches__(record_value, match_value) for
+    each of them. Numeric array columns can only hold numbers, so they skip the per-value type checks.
+    """
+    value_matches = __compile_value_match__(match_value)
+    if is_iterable(match_value):
+        is_member = __get_membership_test__(match_value)
+        array_matches = lambda column: [is_member(v) for v in column]
+    else:
+        array_matches = lambda column: [v == match_value for v in column]
+
+    def column_matches(column):
+        if isinstance(column, array):
+            return array_matches(column)
+        return list(map(value_matches, column))
+    return column_matches
+
+def compile_match_function(match_criteria):
+    # type: (Union[collections.Callable, dict, list, None]) -> collections.Callable
+    """
+    Returns a function that expects a single parameter (record) to be passed to it
+    for a truth test, like __get_match_function__, but match_criteria is analyzed once
+    so that each record only needs set lookups and direct comparisons.
+    If match_criteria is None, then the returned function will always return True.
+    If match_criteria is a function, it is returned as is.
+    If match_criteria is a dictionary, the returned function will match on keys and values.
+    If match_criteria is a list, the returned function will match on values only.
+    """
+    if match_criteria is None:
+        return lambda r: True
+    if is_callable(match_criteria):
+        return match_criteria
+
+    if isinstance(match_criteria, dict):
+        key_matches = [(k, __compile_value_match__(v)) for k, v in match_criteria.items()]
+        if len(key_matches) == 0:
+            return lambda r: False
+
+        def dict_matches(record):
+            if record.__class__ is not dict and is_dict(record) is False:
+                raise AttributeError('The provided object was not a dictionary!')
+            for key, value_matches in key_matches:
+                if key not in record or value_matches(record[key]) is False:
+                    return False
+            return True
+        return dict_matches
+
+    # The record takes the place of the record value, and the match_criteria's values
+    # are looked for in it, so the comparison is reversed
+    if is_iterable(match_criteria):
+        is_member = __get_membership_test__(match_criteria)
+
+        def value_matches(record):
+            if record.__class__ in SCALAR_TYPES or not is_iterable(record):
+                return is_member(record)
+            return any(v in record for v in match_criteria)
+        return value_matches
+    return lambda record: __value_matches__(match_criteria, record)
+
 def read_file(filename, mode='rt', encoding='utf-8'):
     # type: (Union[str, Sequence[str]], str, str) -> Iterator[List[str]]
     """
@@ -135,6 +268,106 @@ def read_file(filename, mode='rt', encoding='utf-8'):
             print('{0} could not be opened!\nError details: {1}'.format(filename, io_e))
             raise
 
+def read_file_blocks(filename, mode='rt', encoding='utf-8', block_size=DEFAULT_BLOCK_SIZE):
+    # type: (Union[str, Sequence[str]], str, str, int) -> Iterator[str]
+    """
+    Works like read_file, but returns the file's content in cleansed blocks of about
+    block_size characters, each of which ends on a line boundary. This avoids the per-line
+    overhead of read_file for large files.
+    """
+    if is_iterable(filename):
+        for file_name in filename:
+            for file_block in read_file_blocks(filename=file_name, mode=mode, encoding=encoding, block_size=block_size):
+                yield file_block
+    else:
+        try:
+            with open(filename, mode=mode, encoding=encoding) as block_file:
+                partial_line = ''
+                file_block = block_file.read(block_size)
+                while len(file_block) > 0:
+                    file_block = partial_line + file_block
+                    line_end = file_block.rfind('\n') + 1
+                    partial_line = file_block[line_end:]
+                    if line_end > 0:
+                        yield clean_file_record(file_block[:line_end])
+                    file_block = block_file.read(block_size)
+                if len(partial_line) > 0:
+                    yield clean_file_record(partial_line)
+
+        except IOError as io_e:
+            print('{0} could not be opened!\nError details: {1}'.format(filename, io_e))
+            raise
+
+def __get_worker_pool__(workers=DEFAULT_FILE_WORKERS, use_processes=False):
+    # type: (int, bool) -> multiprocessing.pool.Pool
+    """
+    Returns a pool of threads, or of processes if use_processes is True
+    """
+    if use_processes is True:
+        return multiprocessing.Pool(processes=workers)
+    return ThreadPool(processes=workers)
+
+def __iter_pool_results__(pool, func, args_iter, max_pending, preserve_order=True):
+    # type: (multiprocessing.pool.Pool, Callable, Iterator[Any], int, bool) -> Iterator[Any]
+    """
+    Works like pool.imap, but only max_pending calls are submitted or waiting to be consumed
+    at a time, so results are not buffered faster than the caller uses them. If preserve_order
+    is False, results that are already finished are returned before waiting on older ones.
+    """
+    pending_results = collections.deque()
+    for func_args in args_iter:
+        pending_results.append(pool.apply_async(func, (func_args,)))
+        if len(pending_results) < max_pending:
+            continue
+        if preserve_order is False:
+            ready_results = [r for r in pending_results if r.ready()]
+            if len(ready_results) > 0:
+                for ready_result in ready_results:
+                    pending_results.remove(ready_result)
+                    yield ready_result.get()
+                continue
+        yield pending_results.popleft().get()
+    while len(pending_results) > 0:
+        yield pending_results.popleft().get()
+
+def __read_file_lines__(file_args):
+    # type: (Tuple[str, str, str]) -> Tuple[str, Optional[List[str]], Optional[str]]
+    """
+    Returns the filename, its cleansed lines, and an error message (if it could not be read).
+    This runs in a worker, so it takes a single tuple of arguments.
+    """
+    filename, mode, encoding = file_args
+    try:
+        with open(filename, mode=mode, encoding=encoding) as input_file:
+            return filename, [clean_file_record(l) for l in input_file], None
+    except (IOError, OSError, ValueError) as io_e:
+        return filename, None, str(io_e)
+
+def read_file_parallel(filename, mode='rt', encoding='utf-8', workers=DEFAULT_FILE_WORKERS, use_processes=False, file_errors=None):
+    # type: (Union[str, Sequence[str]], str, str, int, bool, Optional[Dict[str, str]]) -> Iterator[str]
+    """
+    Works like read_file, but up to workers files are read at once, by a pool of threads
+    (or processes, if use_processes is True). Lines are still returned in the order of the
+    provided filenames, and only a few files per worker are held in memory at a time.
+    Files that cannot be read are skipped, instead of stopping the rest of the files from
+    being read, and their error messages are added to file_errors, if it is provided.
+    """
+    filenames = filename if is_iterable(filename) else [filename]
+    file_args = ((f, mode, encoding) for f in filenames)
+    pool = __get_worker_pool__(workers, use_processes)
+    try:
+        for file_name, file_records, file_error in __iter_pool_results__(pool, __read_file_lines__, file_args,
+                                                                          workers * PENDING_RESULTS_PER_WORKER):
+            if file_error is not None:
+                print('{0} could not be opened!\nError details: {1}'.format(file_name, file_error))
+                if file_errors is not None:
+                    file_errors[file_name] = file_error
+                continue
+            for file_record in file_records:
+                yield file_record
+    finally:
+        pool.terminate()
+
 def read_json_file(filename, filter_key_list=None, key_func=None, value_func=None, value_check_func=None):
     """
     TODO: Make this like read_delimited_file
@@ -180,43 +413,608 @@ def read_json_file(filename, filter_key_list=None, key_func=None, value_func=Non
 
     return return_dict
 
-def read_delimited_file(filename, mode='rt', encoding='utf-8', delimiter=',', field_names=None):
-    # type: (str, str, str, str, Optional[Sequence[str]]) -> Iterator[List[str]]
+class JsonStreamReader(object):
+    """
+    Decodes JSON values from json_file one at a time. Only the part of the file that
+    has not been decoded yet is kept in memory, along with the value being decoded.
+    """
+    WHITESPACE_PATTERN = re.compile(r'[ \t\n\r]*')
+
+    def __init__(self, json_file, read_size=DEFAULT_JSON_READ_SIZE):
+        # type: (IO[str], int) -> None
+        self.json_file = json_file
+        self.read_size = read_size
+        self.buffer = ''
+        self.position = 0
+        self.at_eof = False
+        self.decoder = json.JSONDecoder()
+
+    def read_more(self, size=None):
+        # type: (Optional[int]) -> bool
+        """
+        Adds size characters (read_size by default) from the file to the buffer,
+        and drops the characters that have already been decoded.
+        Returns False if the end of the file has been reached.
+        """
+        if self.at_eof is True:
+            return False
+        file_data = self.json_file.read(size or self.read_size)
+        if len(file_data) == 0:
+            self.at_eof = True
+            return False
+        self.buffer = self.buffer[self.position:] + clean_file_record(file_data)
+        self.position = 0
+        return True
+
+    def peek(self):
+        # type: () -> str
+        """
+        Skips whitespace, and returns the next character without reading it.
+        Returns an empty string at the end of the file.
+        """
+        while True:
+            self.position = self.WHITESPACE_PATTERN.match(self.buffer, self.position).end()
+            if self.position < len(self.buffer):
+                return self.buffer[self.position]
+            if self.read_more() is False:
+                return ''
+
+    def read_char(self):
+        # type: () -> str
+        """
+        Skips whitespace, and returns the next character
+        """
+        next_char = self.peek()
+        self.position += len(next_char)
+        return next_char
+
+    def read_value(self):
+        # type: () -> Any
+        """
+        Decodes and returns the next JSON value. More of the file is read until the
+        value can be decoded. A value that ends at the end of the buffer (like a number)
+        might be incomplete, so it is decoded again once more has been read.
+        """
+        self.peek()
+        while True:
+            # Read more than the buffer's size, so that large values are not decoded too many times
+            read_size = max(self.read_size, len(self.buffer) - self.position)
+            try:
+                value, value_end = self.decoder.raw_decode(self.buffer, self.position)
+            except ValueError as json_e:
+                if self.read_more(read_size) is False:
+                    raise ValueError('The JSON value could not be decoded!\nError details: {0}'.format(json_e))
+                continue
+            if value_end < len(self.buffer) or self.read_more(read_size) is False:
+                self.position = value_end
+                return value
+
+    def expect_char(self, expected_chars):
+        # type: (str) -> str
+        """
+        Reads the next character, and raises a ValueError if it is not in expected_chars
+        """
+        next_char = self.read_char()
+        if next_char == '' or next_char not in expected_chars:
+            raise ValueError('The JSON content is not valid!\nExpected one of {0}, but found {1}'.format(expected_chars, repr(next_char)))
+        return next_char
+
+def iter_json_members(filename, encoding='utf-8', read_size=DEFAULT_JSON_READ_SIZE):
+    # type: (str, str, int) -> Iterator[Tuple[str, Any]]
+    """
+    Returns an iterator of (key, value) pairs from the JSON objects in filename, as they are decoded.
+    The members of a top-level object are returned one at a time. If the top level is an array,
+    or the file is JSON Lines (one value per line), then each object in it is decoded
+    and its members returned. Values that are not objects are skipped.
+    """
+    with open(filename, mode='rt', encoding=encoding) as json_file:
+        reader = JsonStreamReader(json_file, read_size)
+        if reader.peek() == '\ufeff':
+            reader.read_char()
+
+        next_char = reader.peek()
+        while next_char != '':
+            if next_char == '{':
+                reader.read_char()
+                while reader.peek() != '}':
+                    key = reader.read_value()
+                    if not is_str(key):
+                        raise ValueError('The JSON content is not valid!\nObject keys must be strings, but found {0}'.format(repr(key)))
+                    reader.expect_char(':')
+                    yield key, reader.read_value()
+                    if reader.expect_char(',}') == '}':
+                        break
+                else:
+                    reader.read_char()
+            elif next_char == '[':
+                reader.read_char()
+                while reader.peek() != ']':
+                    array_value = reader.read_value()
+                    if is_dict(array_value):
+                        for key, value in array_value.items():
+                            yield key, value
+                    if reader.expect_char(',]') == ']':
+                        break
+                else:
+                    reader.read_char()
+            else:
+                top_value = reader.read_value()
+                if is_dict(top_value):
+                    for key, value in top_value.items():
+                        yield key, value
+            next_char = reader.peek()
+
+def get_json_members(filename, filter_key_list=None, key_func=None, value_func=None, value_check_func=None, encoding='utf-8'):
+    # type: (Union[str, Sequence[str]], Optional[Union[str, Sequence[str]]], Optional[Callable], Optional[Callable], Optional[Callable], str) -> Iterator[Tuple[str, Any]]
+    """
+    Returns an iterator of (key, value) pairs from the JSON objects in filename (or list of filenames),
+    filtered and transformed like read_json_file, as each member is decoded (see iter_json_members).
+    If filter_key_list is None, then every key is returned.
+    """
+    do_nothing_func = lambda v: v
+    k_func = key_func if is_callable(key_func) else do_nothing_func
+    v_func = value_func if is_callable(value_func) else do_nothing_func
+    vc_func = value_check_func if is_callable(value_check_func) else (lambda v: True)
+
+    filter_dict = None
+    if filter_key_list is not None:
+        filter_keys = filter_key_list if is_iterable(filter_key_list) else [filter_key_list]
+        filter_dict = dict((k_func(k), k) for k in filter_keys)
+
+    for file_name in (filename if is_iterable(filename) else [filename]):
+        for key, value in iter_json_members(file_name, encoding=encoding):
+            if filter_dict is not None:
+                compare_key = k_func(key)
+                if compare_key not in filter_dict:
+                    continue
+                key = filter_dict[compare_key]
+            if vc_func(value) is True:
+                yield key, v_func(value)
+
+def read_json_stream(filename, filter_key_list=None, key_func=None, value_func=None, value_check_func=None, encoding='utf-8'):
+    # type: (Union[str, Sequence[str]], Optional[Union[str, Sequence[str]]], Optional[Callable], Optional[Callable], Optional[Callable], str) -> Dict[str, Any]
+    """
+    Works like read_json_file, but the file is decoded incrementally instead of being read
+    into a single string first, and JSON Lines files are supported. Later keys replace
+    earlier ones. See get_json_members for more detail.
+    """
+    return dict(get_json_members(filename, filter_key_list, key_func, value_func, value_check_func, encoding))
+
+def __read_json_members__(file_args):
+    # type: (Tuple[str, Any, Any, Any, Any, str]) -> Tuple[str, Optional[List[Tuple[str, Any]]], Optional[str]]
+    """
+    Returns the filename, its filtered members (see get_json_members), and an error message
+    (if it could not be read or decoded, or one of the provided functions failed). This runs
+    in a worker, so it takes a single tuple of arguments.
+    """
+    filename = file_args[0]
+    try:
+        return filename, list(get_json_members(*file_args)), None
+    except (IOError, OSError, ValueError) as json_e:
+        return filename, None, str(json_e)
+    except Exception as func_e:
+        return filename, None, '{0}: {1}'.format(type(func_e).__name__, func_e)
+
+def read_json_file_parallel(filename, filter_key_list=None, key_func=None, value_func=None, value_check_func=None,
+                            encoding='utf-8', workers=DEFAULT_FILE_WORKERS, use_processes=False, file_errors=None):
+    # type: (Union[str, Sequence[str]], Optional[Union[str, Sequence[str]]], Optional[Callable], Optional[Callable], Optional[Callable], str, int, bool, Optional[Dict[str, str]]) -> Dict[str, Any]
+    """
+    Works like read_json_stream, but up to workers files are read and decoded at once,
+    by a pool of threads (or processes, if use_processes is True, in which case the provided
+    functions must be picklable). Results are merged in the order of the provided filenames,
+    so keys in later files replace those in earlier files, the same as reading them one by one.
+    Files that cannot be read or decoded, or for which key_func, value_func or value_check_func
+    raise an error, are skipped the same way as in read_file_parallel, and their error messages
+    are added to file_errors, if it is provided.
+    """
+    filenames = filename if is_iterable(filename) else [filename]
+    file_args = ((f, filter_key_list, key_func, value_func, value_check_func, encoding) for f in filenames)
+    return_dict = {}
+    pool = __get_worker_pool__(workers, use_processes)
+    try:
+        for file_name, file_members, file_error in __iter_pool_results__(pool, __read_json_members__, file_args,
+                                                                          workers * PENDING_RESULTS_PER_WORKER):
+            if file_error is not None:
+                print('{0} could not be opened!\nError details: {1}'.format(file_name, file_error))
+                if file_errors is not None:
+                    file_errors[file_name] = file_error
+                continue
+            return_dict.update(file_members)
+    finally:
+        pool.terminate()
+
+    return return_dict
+
+def get_delimiter(delimiter=None, dialect=None):
+    # type: (Optional[str], Optional[Union[str, csv.Dialect]]) -> str
+    """
+    Returns delimiter if it is provided, otherwise the delimiter of dialect (a csv dialect
+    name or csv.Dialect), or ',' if neither is provided.
+    """
+    if delimiter is not None:
+        return delimiter
+    if dialect is None:
+        return ','
+    return (csv.get_dialect(dialect) if is_str(dialect) else dialect).delimiter
+
+def read_delimited_file(filename, mode='rt', encoding='utf-8', delimiter=None, field_names=None, dialect=None):
+    # type: (str, str, str, Optional[str], Optional[Sequence[str]], Optional[Union[str, csv.Dialect]]) -> Iterator[List[str]]
     """
     Returns an iterator for filename, which can be a string referencing a single file
-    or a list of filenames. Each line is cleansed, then split by delimiter. If field_names
+    or a list of filenames. Each line is cleansed, then split by delimiter (',' by default). If field_names
     is provided, then the returned iterator will produce a dict, otherwise it will be a list.
     If field_names is provided and the file has a header row, the header row will not be
     in the returned records.
+    If dialect is provided (a csv dialect name, like 'excel', or a csv.Dialect), then the
+    records are parsed by the csv module instead, so quoted values can contain the delimiter
+    or newlines, and the dialect's delimiter is used unless delimiter is provided.
+    """
+    check_field_names(field_names)
+    delimiter = get_delimiter(delimiter, dialect)
+    if dialect is None:
+        file_records = __strip_bom__(read_file(filename=filename, mode=mode, encoding=encoding))
+        parsed_records = __parse_delimited_records__(file_records, delimiter, field_names)
+    else:
+        file_blocks = __strip_bom__(read_file_blocks(filename=filename, mode=mode, encoding=encoding))
+        parsed_records = __parse_csv_blocks__(file_blocks, delimiter, field_names, dialect)
+
+    for file_record in parsed_records:
+        yield file_record
+
+def __strip_bom__(file_records):
+    # type: (Iterator[str]) -> Iterator[str]
+    """
+    Returns file_records, with the byte order mark removed from the first record.
+    This also works for blocks from read_file_blocks
+    """
+    file_records = iter(file_records)
+    for first_record in file_records:
+        if first_record.startswith('\ufeff'):
+            first_record = first_record[1:]
+        return chain([first_record], file_records)
+    return file_records
+
+def check_field_names(field_names):
+    # type: (Optional[Sequence[str]]) -> None
+    """
+    Raises an AttributeError if field_names is provided, but is not a sequence
+    """
+    if field_names is not None and is_sequence(field_names) is False:
+        raise AttributeError('Field names must be a sequence!')
+
+def __parse_delimited_records__(file_records, delimiter=',', field_names=None, check_header=True):
+    # type: (Iterator[str], str, Optional[Sequence[str]], bool) -> Iterator[Union[Dict[str, str], List[str]]]
+    """
+    Splits each of the file_records by delimiter, after removing its line ending. If
+    field_names is provided, then each record is returned as a dict, and the first record
+    is skipped if check_header is True and it is a header row.
     """
-    check_header = False
     first_line = None
     if field_names is not None:
-        if is_sequence(field_names):
-            first_line = delimiter.join(field_names)
-            check_header = True
-        else:
-            raise AttributeError('Field names must be a sequence!')
+        first_line = delimiter.join(field_names)
+    else:
+        check_header = False
 
-    for file_record in read_file(filename=filename, mode=mode, encoding=encoding):
+    for file_record in file_records:
         if check_header is True:
             check_header = False
             if file_record.startswith(first_line) is True:
                 continue
 
-        file_record = file_record.split(delimiter)
+        file_record = file_record.rstrip('\r\n').split(delimiter)
         if field_names is not None:
             file_record = dict(zip(field_names, file_record))
 
         yield file_record
 
+def is_split_dialect(dialect):
+    # type: (Union[str, csv.Dialect]) -> bool
+    """
+    Returns True if a csv.reader with dialect splits a line that has no quote characters in it
+    the same way as str.split does with the dialect's delimiter
+    """
+    csv_dialect = csv.get_dialect(dialect) if is_str(dialect) else dialect
+    return (csv_dialect.skipinitialspace is False and csv_dialect.escapechar is None and
+            csv_dialect.quoting != csv.QUOTE_NONNUMERIC)
+
+def __get_block_lines__(file_block):
+    # type: (str) -> List[str]
+    """
+    Returns the lines in file_block, each with its newline. Unlike str.splitlines, lines are
+    only split on newlines, the same as a file opened in text mode.
+    """
+    block_lines = file_block.split('\n')
+    return [l + '\n' for l in block_lines[:-1]] + ([block_lines[-1]] if len(block_lines[-1]) > 0 else [])
+
+def __split_csv_blocks__(file_blocks, delimiter=None, dialect='excel'):
+    # type: (Iterator[str], Optional[str], Union[str, csv.Dialect]) -> Iterator[List[List[str]]]
+    """
+    Returns the rows in each of file_blocks, as parsed by a csv.reader. If the dialect splits
+    unquoted lines the same way as str.split (see is_split_dialect), blocks that have no quote
+    characters in them are split by delimiter (the dialect's delimiter, by default) instead,
+    which is faster. Other blocks are read line by line by a single csv.reader, which reads on
+    into the next blocks when a quoted value continues past the end of a block, so only the
+    record that is being parsed is held, however the quotes in the file are placed.
+    Blank rows are not returned.
+    """
+    csv_dialect = csv.get_dialect(dialect) if is_str(dialect) else dialect
+    delimiter = get_delimiter(delimiter, csv_dialect)
+    quote_char = csv_dialect.quotechar
+    can_split = is_split_dialect(csv_dialect)
+    file_blocks = iter(file_blocks)
+    pending_lines = collections.deque()
+
+    def iter_pending_lines():
+        while True:
+            if len(pending_lines) == 0:
+                next_block = next(file_blocks, None)
+                if next_block is None:
+                    return
+                pending_lines.extend(__get_block_lines__(next_block))
+            yield pending_lines.popleft()
+
+    csv_reader = csv.reader(iter_pending_lines(), dialect=csv_dialect, delimiter=delimiter)
+    for file_block in file_blocks:
+        if can_split is True and (quote_char is None or quote_char not in file_block):
+            yield [l.split(delimiter) for l in file_block.split('\n') if len(l) > 0]
+            continue
+
+        pending_lines.extend(__get_block_lines__(file_block))
+        block_rows = []
+        while len(pending_lines) > 0:
+            csv_row = next(csv_reader, None)
+            if csv_row is None:
+                break
+            if len(csv_row) > 0:
+                block_rows.append(csv_row)
+        yield block_rows
+
+def __parse_csv_blocks__(file_blocks, delimiter=None, field_names=None, dialect='excel', check_header=True):
+    # type: (Iterator[str], Optional[str], Optional[Sequence[str]], Union[str, csv.Dialect], bool) -> Iterator[Union[Dict[str, str], List[str]]]
+    """
+    Works like __parse_delimited_records__, but file_blocks (see read_file_blocks) are
+    parsed as csv, which handles quoted values. delimiter defaults to the dialect's delimiter.
+    """
+    delimiter = get_delimiter(delimiter, dialect)
+    first_line = None
+    if field_names is not None:
+        first_line = delimiter.join(field_names)
+    else:
+        check_header = False
+
+    for block_records in __split_csv_blocks__(file_blocks, delimiter, dialect):
+        if check_header is True and len(block_records) > 0:
+            check_header = False
+            if delimiter.join(block_records[0]).startswith(first_line) is True:
+                block_records = block_records[1:]
+
+        if field_names is None:
+            for file_record in block_records:
+                yield file_record
+        else:
+            for file_record in block_records:
+                yield dict(zip(field_names, file_record))
+
+def get_file_chunks(filename, chunk_size=DEFAULT_CHUNK_SIZE):
+    # type: (str, int) -> List[Tuple[int, int]]
+    """
+    Returns a list of (start, end) byte offsets that split filename into chunks of about
+    chunk_size bytes. Every chunk but the last ends just after a newline, so no line
+    is split between two chunks.
+    """
+    file_size = os.path.getsize(filename)
+    chunks = []
+    start = 0
+    with open(filename, mode='rb') as chunk_file:
+        while start < file_size:
+            end = start + chunk_size
+            if end < file_size:
+                chunk_file.seek(end)
+                chunk_file.readline()
+                end = chunk_file.tell()
+            else:
+                end = file_size
+            chunks.append((start, end))
+            start = end
+    return chunks
+
+def __read_delimited_chunk__(chunk_args):
+    # type: (Tuple[str, int, int, str, str, Optional[Sequence[str]], Optional[Union[str, csv.Dialect]]]) -> List[Union[Dict[str, str], List[str]]]
+    """
+    Reads and parses the records in one chunk of a delimited file, with the csv module if dialect
+    is provided. This runs in a worker process, so it takes a single tuple of arguments.
+    """
+    filename, start, end, encoding, delimiter, field_names, dialect = chunk_args
+    with open(filename, mode='rb') as chunk_file:
+        chunk_file.seek(start)
+        chunk_data = chunk_file.read(end - start)
+    # Decode the same way that a file opened in text mode would be
+    chunk_lines = (clean_file_record(l) for l in TextIOWrapper(BytesIO(chunk_data), encoding=encoding))
+    if start == 0:
+        chunk_lines = __strip_bom__(chunk_lines)
+    if dialect is not None:
+        return list(__parse_csv_blocks__([''.join(chunk_lines)], delimiter, field_names, dialect, check_header=start == 0))
+    return list(__parse_delimited_records__(chunk_lines, delimiter, field_names, check_header=start == 0))
+
+def __file_contains__(filename, search_bytes, block_size=DEFAULT_BLOCK_SIZE):
+    # type: (str, bytes, int) -> bool
+    """
+    Returns True if search_bytes (a single character) is found in filename, reading it block_size bytes at a time
+    """
+    with open(filename, mode='rb') as search_file:
+        file_block = search_file.read(block_size)
+        while len(file_block) > 0:
+            if search_bytes in file_block:
+                return True
+            file_block = search_file.read(block_size)
+    return False
+
+def read_delimited_file_parallel(filename, encoding='utf-8', delimiter=None, field_names=None, processes=None,
+                                 chunk_size=DEFAULT_CHUNK_SIZE, preserve_order=True, dialect=None):
+    # type: (Union[str, Sequence[str]], str, Optional[str], Optional[Sequence[str]], Optional[int], int, bool, Optional[Union[str, csv.Dialect]]) -> Iterator[Union[Dict[str, str], List[str]]]
+    """
+    Works like read_delimited_file, but splits each file into chunks of about chunk_size bytes
+    (on line boundaries) and parses the chunks in a pool of processes. processes defaults to
+    the number of CPUs. Only PENDING_RESULTS_PER_WORKER chunks per process are read ahead
+    of the records being used. If preserve_order is False, then records are returned as soon
+    as their chunk has been parsed, which may not be the order that they are in the file.
+    The delimiter is found the same way as in read_delimited_file. If dialect is provided, each file
+    is searched for the dialect's quote character first. A quoted value can contain newlines, so
+    files that have one are parsed by read_delimited_file in this process instead of being split.
+    The encoding must use a single newline byte, like UTF-8 or ASCII.
+    """
+    check_field_names(field_names)
+    filenames = filename if is_iterable(filename) else [filename]
+    delimiter = get_delimiter(delimiter, dialect)
+    quote_bytes = None
+    if dialect is not None:
+        quote_char = (csv.get_dialect(dialect) if is_str(dialect) else dialect).quotechar
+        if quote_char is not None:
+            quote_bytes = quote_char.encode(encoding)
+    has_quotes = lambda f: quote_bytes is not None and __file_contains__(f, quote_bytes)
+
+    processes = processes or multiprocessing.cpu_count()
+    pool = multiprocessing.Pool(processes=processes)
+    try:
+        # Runs of files without quotes are parsed in the pool together, so small files still keep every process busy
+        for is_quoted, file_group in groupby(filenames, has_quotes):
+            if is_quoted is True:
+                for file_name in file_group:
+                    for file_record in read_delimited_file(file_name, encoding=encoding, delimiter=delimiter,
+                                                           field_names=field_names, dialect=dialect):
+                        yield file_record
+                continue
+            chunk_args = (
+                (file_name, start, end, encoding, delimiter, field_names, dialect)
+                for file_name in file_group
+                for start, end in get_file_chunks(file_name, chunk_size)
+            )
+            for chunk_records in __iter_pool_results__(pool, __read_delimited_chunk__, chunk_args,
+                                                       processes * PENDING_RESULTS_PER_WORKER, preserve_order):
+                for file_record in chunk_records:
+                    yield file_record
+    finally:
+        pool.terminate()
+
+def __get_numeric_value__(value):
+    # type: (str) -> float
+    """
+    Returns value as a float, or NaN if value is blank
+    """
+    value = value.strip()
+    return float(value) if len(value) > 0 else float('nan')
+
+def read_delimited_batches(filename, field_names, batch_size=DEFAULT_BATCH_SIZE, numeric_fields=None, mode='rt',
+                           encoding='utf-8', delimiter=None, dialect=None):
+    # type: (Union[str, Sequence[str]], Sequence[str], int, Optional[Sequence[str]], str, str, Optional[str], Optional[Union[str, csv.Dialect]]) -> Iterator[Dict[str, Union[List[str], array]]]
+    """
+    Works like read_delimited_file, but returns batches of up to batch_size records,
+    as a dict of columns. Each key in the dict is one of field_names, and each value
+    is a list of the values for that field, in record order. This avoids building a
+    dict for every record.
+    Fields in numeric_fields are returned as array('d') columns, where blank values
+    are NaN. These can be wrapped with numpy.frombuffer without copying them.
+    Short records are padded with blank values.
+    """
+    check_field_names(field_names)
+    if field_names is None:
+        raise AttributeError('Field names must be provided for batches!')
+    numeric_fields = set(numeric_fields or [])
+    unknown_fields = numeric_fields.difference(field_names)
+    if len(unknown_fields) > 0:
+        raise AttributeError('The numeric fields are not in field_names!\nProvided fields: {0}'.format(', '.join(unknown_fields)))
+
+    delimiter = get_delimiter(delimiter, dialect)
+    file_records = read_delimited_file(filename, mode=mode, encoding=encoding, delimiter=delimiter, dialect=dialect)
+    first_line = delimiter.join(field_names)
+    field_count = len(field_names)
+    for first_record in file_records:
+        if delimiter.join(first_record).startswith(first_line) is False:
+            file_records = chain([first_record], file_records)
+        break
+
+    batch_records = list(islice(file_records, batch_size))
+    while len(batch_records) > 0:
+        columns = list(six.moves.zip_longest(*batch_records, fillvalue=''))[:field_count]
+        # Every record could be shorter than field_names
+        columns += [('',) * len(batch_records)] * (field_count - len(columns))
+        record_batch = {}
+        for field_name, column in zip(field_names, columns):
+            if field_name in numeric_fields:
+                record_batch[field_name] = array('d', map(__get_numeric_value__, column))
+            else:
+                record_batch[field_name] = list(column)
+        yield record_batch
+        batch_records = list(islice(file_records, batch_size))
+
+def get_batch_length(record_batch):
+    # type: (Dict[str, Sequence[Any]]) -> int
+    """
+    Returns the number of records in record_batch
+    """
+    for column in record_batch.values():
+        return len(column)
+    return 0
+
+def get_batch_records(record_batch):
+    # type: (Dict[str, Sequence[Any]]) -> Iterator[Dict[str, Any]]
+    """
+    Returns each record in record_batch as a dict
+    """
+    field_names = list(record_batch)
+    for record_values in zip(*[record_batch[f] for f in field_names]):
+        yield dict(zip(field_names, record_values))
+
 def get_matching_records(match_criteria, record_iterator):
     # type: (Callable, Iterator[Union[Dict[str: Any], List[Any]]) -> Iterator[Union[Dict[str: Any], List[Any]]
     """
     Returns all records from record_iterator that match the provided match_criteria.
     See the doc for __get_match_function__ for more detail
     """
-    match_func = __get_match_function__(match_criteria)
+    match_func = compile_match_function(match_criteria)
     for record in record_iterator:
         if match_func(record) is True:
-            yield record
\ No newline at end of file
+            yield record
+
+def get_batch_match_mask(match_criteria, record_batch):
+    # type: (Union[collections.Callable, dict, list, None], Dict[str, Sequence[Any]]) -> List[bool]
+    """
+    Returns a list with True for each record in record_batch (see read_delimited_batches)
+    that matches match_criteria, and False for the others. If match_criteria is a dict,
+    it is evaluated a whole column at a time. Other match_criteria are tested against
+    each record, as a dict.
+    """
+    batch_length = get_batch_length(record_batch)
+    if match_criteria is None:
+        return [True] * batch_length
+
+    if isinstance(match_criteria, dict):
+        if len(match_criteria) == 0 or any(k not in record_batch for k in match_criteria):
+            return [False] * batch_length
+        match_mask = None
+        for key, match_value in match_criteria.items():
+            column_mask = __compile_column_match__(match_value)(record_batch[key])
+            match_mask = column_mask if match_mask is None else [m and c for m, c in zip(match_mask, column_mask)]
+        return match_mask
+
+    match_func = compile_match_function(match_criteria)
+    return [match_func(r) is True for r in get_batch_records(record_batch)]
+
+def get_matching_batches(match_criteria, batch_iterator):
+    # type: (Union[collections.Callable, dict, list, None], Iterator[Dict[str, Sequence[Any]]]) -> Iterator[Dict[str, Sequence[Any]]]
+    """
+    Returns each batch from batch_iterator (see read_delimited_batches), with only
+    the records that match the provided match_criteria. Batches with no matching
+    records are not returned. See get_batch_match_mask for more detail.
+    """
+    for record_batch in batch_iterator:
+        match_mask = get_batch_match_mask(match_criteria, record_batch)
+        if any(match_mask) is False:
+            continue
+        matching_batch = {}
+        for field_name, column in record_batch.items():
+            if isinstance(column, array):
+                matching_batch[field_name] = array(column.typecode, compress(column, match_mask))
+            else:
+                matching_batch[field_name] = list(compress(column, match_mask))
+        yield matching_batch
\ No newline at end of file
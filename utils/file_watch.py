@@ -0,0 +1,368 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import (absolute_import, division, generators, nested_scopes, print_function, unicode_literals, with_statement)
+from builtins import (bytes, dict, int, list, object, range, str, ascii, chr, hex, input, next, oct, open, pow, round, super, filter, map, zip)
+from collections import namedtuple
+import ctypes
+import ctypes.util
+import errno
+import os
+from pathlib import Path
+import select
+import stat
+import struct
+import time
+from typing import (Dict, Iterator, List, Tuple, Union)
+
+import futils
+
+"""
+Watches directory trees for new, modified and moved files, using inotify on Linux,
+or by comparing directory listings everywhere else.
+"""
+
+PATH_LIKE = futils.PATH_LIKE
+PATH_LIKE_ITERABLE = futils.PATH_LIKE_ITERABLE
+# Seconds between directory listings, when inotify is not available
+DEFAULT_POLL_INTERVAL = 1.0
+FILE_CREATED = 'created'
+FILE_MODIFIED = 'modified'
+FILE_MOVED = 'moved'
+# inotify constants, from <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+EVENT_HEADER = struct.Struct('iIII')
+EVENT_BUFFER_SIZE = 64 * 1024
+# Seconds subtracted from the last time the event queue was read, when the queue overflows and the
+# watched trees are rescanned for files changed since then, to allow for coarse file timestamps
+RESCAN_TIME_SLACK = 1.0
+
+FileEvent = namedtuple('FileEvent', ['event_type', 'path'])
+
+def __get_libc__():
+    """
+    Returns libc, if it provides inotify. Otherwise, returns None.
+    """
+    libc_name = ctypes.util.find_library('c')
+    if libc_name is None:
+        return None
+    try:
+        libc = ctypes.CDLL(libc_name, use_errno=True)
+        libc.inotify_init1
+        libc.inotify_add_watch
+        libc.inotify_rm_watch
+    except (AttributeError, OSError):
+        return None
+    libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+    libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+    return libc
+
+def is_inotify_available() -> bool:
+    """
+    Returns True if inotify can be used to watch directories.
+    """
+    return __get_libc__() is not None
+
+class InotifyWatcher(object):
+    """
+    Watches one or more directory trees with inotify, and yields a FileEvent for each file that
+    is created, written or moved into a watched directory. Files are reported when they are closed
+    after writing, so the file is complete when it is yielded. New directories are watched as they
+    appear, and the files that were already in them are reported as created (a file that is written
+    while its new directory is being added can be reported twice). Symbolic and hard links are reported
+    as soon as they are created, since they are never written (so a new file that is linked before it
+    is closed is reported as created, and then as modified).
+
+    If the inotify event queue overflows, the events that were lost can't be recovered, so the watched
+    trees are rescanned, and each matching file that was changed or moved since the queue was last
+    read is reported as modified.
+    """
+    def __init__(self, directory:Union[PATH_LIKE, PATH_LIKE_ITERABLE], file_mask:str=None, recursive=True,
+                 exclusion_list:List[PATH_LIKE]=None):
+        self.libc = __get_libc__()
+        if self.libc is None:
+            raise OSError('inotify is not available on this system!')
+        self.name_matches = futils.__get_name_matcher__(file_mask)
+        self.recursive = recursive
+        self.exclusions = [str(e) for e in exclusion_list or []]
+        self.directories = [str(Path(d)) for d in (directory if futils.is_iterable(directory) else [directory])]
+        self.watched_dirs = {}
+        self.created_files = set()
+        self.last_read_time = time.time()
+        self.inotify_fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.inotify_fd < 0:
+            raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+        try:
+            for this_directory in self.directories:
+                self.add_watch(this_directory)
+        except OSError:
+            self.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """
+        Stops watching all directories
+        """
+        if self.inotify_fd >= 0:
+            os.close(self.inotify_fd)
+            self.inotify_fd = -1
+
+    def is_excluded(self, path:str) -> bool:
+        """
+        Returns True if path contains an item in exclusion_list
+        """
+        return len(self.exclusions) > 0 and any(e in path for e in self.exclusions)
+
+    def add_watch(self, dir_path:str) -> List[str]:
+        """
+        Watches dir_path (and its subdirectories, if recursive is True), and returns the matching
+        files that are already in them.
+        """
+        existing_files = []
+        pending_dirs = [dir_path]
+        while len(pending_dirs) > 0:
+            this_dir = pending_dirs.pop()
+            watch_id = self.libc.inotify_add_watch(self.inotify_fd, os.fsencode(this_dir), WATCH_MASK)
+            if watch_id < 0:
+                error_number = ctypes.get_errno()
+                # The directory was removed, or replaced with a file, before it could be watched
+                if error_number in (errno.ENOENT, errno.ENOTDIR):
+                    continue
+                raise OSError(error_number, '{0}\nProvided directory: {1}'.format(os.strerror(error_number), this_dir))
+            self.watched_dirs[watch_id] = this_dir
+            matching_entries, child_dirs = futils.__scan_directory__(this_dir, self.name_matches, self.exclusions, self.recursive)
+            existing_files += [e.path for e in matching_entries if e.is_file()]
+            pending_dirs += child_dirs
+        return existing_files
+
+    def remove_watch(self, dir_path:str):
+        """
+        Stops watching dir_path and its subdirectories, and forgets any files created in them that
+        have not been reported yet. Used when a directory is moved, since the watches on its
+        subdirectories would otherwise keep reporting events under their old paths.
+        """
+        dir_prefix = os.path.join(dir_path, '')
+        for watch_id, watched_dir in list(self.watched_dirs.items()):
+            if watched_dir == dir_path or watched_dir.startswith(dir_prefix):
+                # Fails if the directory was already removed, which is fine
+                self.libc.inotify_rm_watch(self.inotify_fd, watch_id)
+                del self.watched_dirs[watch_id]
+        self.created_files = {f for f in self.created_files if not f.startswith(dir_prefix)}
+
+    def rescan(self, changed_since:float) -> List[FileEvent]:
+        """
+        Watches any directories in the watched trees that are not watched yet, and returns a
+        FILE_MODIFIED event for each matching file whose mtime or ctime is at or after changed_since
+        (seconds since the epoch). A move updates a file's ctime, so moved files are included.
+        """
+        file_events = []
+        for this_directory in self.directories:
+            for file_path in self.add_watch(this_directory):
+                try:
+                    file_stat = os.stat(file_path)
+                except OSError:
+                    continue
+                if max(file_stat.st_mtime, file_stat.st_ctime) >= changed_since:
+                    file_events.append(FileEvent(FILE_MODIFIED, Path(file_path)))
+        return file_events
+
+    def __read_events__(self) -> Iterator[Tuple[int, int, str]]:
+        """
+        Yields a (watch_id, mask, name) tuple for each inotify event that is ready, reading until
+        the event queue is empty.
+        """
+        while True:
+            try:
+                event_buffer = os.read(self.inotify_fd, EVENT_BUFFER_SIZE)
+            except BlockingIOError:
+                return
+            buffer_position = 0
+            while buffer_position < len(event_buffer):
+                watch_id, event_mask, _, name_length = EVENT_HEADER.unpack_from(event_buffer, buffer_position)
+                buffer_position += EVENT_HEADER.size
+                name = os.fsdecode(event_buffer[buffer_position:buffer_position + name_length].rstrip(b'\0'))
+                buffer_position += name_length
+                yield watch_id, event_mask, name
+
+    def __get_created_event__(self, file_path:str) -> List[FileEvent]:
+        """
+        Returns a FILE_CREATED event for file_path if it is a link to a file, since links are never
+        written. Regular files are remembered until they are closed after writing, and anything
+        else (directories, pipes, devices, broken links) is ignored.
+        """
+        try:
+            file_stat = os.lstat(file_path)
+        except OSError:
+            return []
+        if stat.S_ISREG(file_stat.st_mode) and file_stat.st_nlink == 1:
+            self.created_files.add(file_path)
+            return []
+        if os.path.isfile(file_path):
+            return [FileEvent(FILE_CREATED, Path(file_path))]
+        return []
+
+    def get_events(self, timeout:float=None) -> List[FileEvent]:
+        """
+        Waits up to timeout seconds (or forever, if timeout is None) for file events, and
+        returns them. Returns an empty list if the timeout passed with no events.
+        """
+        file_events = []
+        ready_fds, _, _ = select.select([self.inotify_fd], [], [], timeout)
+        if len(ready_fds) == 0:
+            return file_events
+        previous_read_time, self.last_read_time = self.last_read_time, time.time()
+        queue_overflowed = False
+        for watch_id, event_mask, name in self.__read_events__():
+            if event_mask & IN_Q_OVERFLOW:
+                queue_overflowed = True
+                continue
+            dir_path = self.watched_dirs.get(watch_id)
+            if event_mask & IN_IGNORED or event_mask & IN_DELETE_SELF or event_mask & IN_MOVE_SELF:
+                self.watched_dirs.pop(watch_id, None)
+                continue
+            if dir_path is None or name == '':
+                continue
+            event_path = os.path.join(dir_path, name)
+            if self.is_excluded(event_path):
+                continue
+            if event_mask & IN_ISDIR:
+                if event_mask & IN_MOVED_FROM:
+                    self.remove_watch(event_path)
+                elif self.recursive is True and event_mask & (IN_CREATE | IN_MOVED_TO):
+                    file_events += [FileEvent(FILE_CREATED, Path(f)) for f in self.add_watch(event_path)]
+            elif self.name_matches(name) is False:
+                continue
+            elif event_mask & IN_CREATE:
+                file_events += self.__get_created_event__(event_path)
+            elif event_mask & IN_CLOSE_WRITE:
+                if event_path in self.created_files:
+                    self.created_files.discard(event_path)
+                    file_events.append(FileEvent(FILE_CREATED, Path(event_path)))
+                else:
+                    file_events.append(FileEvent(FILE_MODIFIED, Path(event_path)))
+            elif event_mask & IN_MOVED_TO:
+                file_events.append(FileEvent(FILE_MOVED, Path(event_path)))
+            elif event_mask & (IN_MOVED_FROM | IN_DELETE):
+                self.created_files.discard(event_path)
+        if queue_overflowed:
+            reported_paths = {e.path for e in file_events}
+            file_events += [e for e in self.rescan(previous_read_time - RESCAN_TIME_SLACK) if e.path not in reported_paths]
+        return file_events
+
+class PollingWatcher(object):
+    """
+    Watches one or more directory trees by listing them every poll_interval seconds, and comparing
+    the size, mtime and inode of each file with the previous listing. A file that appears with the
+    inode of a file that disappeared is reported as moved.
+    """
+    def __init__(self, directory:Union[PATH_LIKE, PATH_LIKE_ITERABLE], file_mask:str=None, recursive=True,
+                 exclusion_list:List[PATH_LIKE]=None, poll_interval:float=DEFAULT_POLL_INTERVAL):
+        self.directory = directory
+        self.file_mask = file_mask
+        self.recursive = recursive
+        self.exclusion_list = exclusion_list
+        self.poll_interval = poll_interval
+        self.file_states = self.get_file_states()
+        self.next_poll = time.monotonic() + poll_interval
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """
+        Does nothing, since polling does not hold any resources
+        """
+        pass
+
+    def get_file_states(self) -> Dict[str, Tuple[int, int, int]]:
+        """
+        Returns a dict of {path: (size, mtime_ns, inode)} for the watched files
+        """
+        file_states = {}
+        for dir_entry in futils.iter_file_entries(self.directory, self.file_mask, self.recursive, self.exclusion_list):
+            try:
+                entry_stat = dir_entry.stat(follow_symlinks=False)
+            except OSError:
+                continue
+            file_states[dir_entry.path] = (entry_stat.st_size, entry_stat.st_mtime_ns, entry_stat.st_ino)
+        return file_states
+
+    def get_events(self, timeout:float=None) -> List[FileEvent]:
+        """
+        Waits up to timeout seconds (or forever, if timeout is None) for file events, and
+        returns them. Returns an empty list if the timeout passed with no events.
+        """
+        stop_time = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait_time = self.next_poll - time.monotonic()
+            if stop_time is not None and stop_time - time.monotonic() < wait_time:
+                time.sleep(max(0, stop_time - time.monotonic()))
+                return []
+            time.sleep(max(0, wait_time))
+            self.next_poll = time.monotonic() + self.poll_interval
+
+            file_states = self.get_file_states()
+            removed_inodes = {self.file_states[p][2] for p in set(self.file_states).difference(file_states)}
+            file_events = []
+            for file_path, file_state in file_states.items():
+                previous_state = self.file_states.get(file_path)
+                if previous_state is None:
+                    event_type = FILE_MOVED if file_state[2] in removed_inodes else FILE_CREATED
+                    file_events.append(FileEvent(event_type, Path(file_path)))
+                elif previous_state != file_state:
+                    file_events.append(FileEvent(FILE_MODIFIED, Path(file_path)))
+            self.file_states = file_states
+            if len(file_events) > 0:
+                return file_events
+
+def get_watcher(directory:Union[PATH_LIKE, PATH_LIKE_ITERABLE], file_mask:str=None, recursive=True,
+                exclusion_list:List[PATH_LIKE]=None, use_inotify:bool=None, poll_interval:float=DEFAULT_POLL_INTERVAL):
+    """
+    Returns an InotifyWatcher for the given directory or list of directories, or a PollingWatcher
+    if inotify is not available, or use_inotify is False. If use_inotify is None, a PollingWatcher
+    is also used when the directories can't be watched (for example, the inotify watch limit was hit).
+    """
+    if use_inotify is not False and (use_inotify is True or is_inotify_available()):
+        try:
+            return InotifyWatcher(directory, file_mask, recursive, exclusion_list)
+        except OSError:
+            if use_inotify is True:
+                raise
+    return PollingWatcher(directory, file_mask, recursive, exclusion_list, poll_interval)
+
+def watch_files(directory:Union[PATH_LIKE, PATH_LIKE_ITERABLE], file_mask:str=None, recursive=True,
+                exclusion_list:List[PATH_LIKE]=None, timeout:float=None, use_inotify:bool=None,
+                poll_interval:float=DEFAULT_POLL_INTERVAL) -> Iterator[FileEvent]:
+    """
+    Yields a FileEvent for each file in the given directory or list of directories that is created,
+    modified or moved, as it happens. Only files whose name matches the glob string file_mask, and
+    whose path does not contain an item in exclusion_list, are reported, the same as futils.get_files.
+    Files that already exist are not reported. Stops after timeout seconds, if it is not None.
+    See get_watcher for use_inotify and poll_interval.
+    """
+    stop_time = None if timeout is None else time.monotonic() + timeout
+    with get_watcher(directory, file_mask, recursive, exclusion_list, use_inotify, poll_interval) as watcher:
+        while stop_time is None or time.monotonic() < stop_time:
+            wait_time = None if stop_time is None else max(0, stop_time - time.monotonic())
+            yield from watcher.get_events(wait_time)
@@ -2,12 +2,20 @@
 # -*- coding: utf-8 -*-
 from __future__ import (absolute_import, division, generators, nested_scopes, print_function, unicode_literals, with_statement)
 from builtins import (bytes, dict, int, list, object, range, str, ascii, chr, hex, input, next, oct, open, pow, round, super, filter, map, zip)
-from collections import Sequence
+from collections import namedtuple, Sequence
+import errno
+from fnmatch import translate
+import hashlib
+from multiprocessing.pool import ThreadPool
 import os
 from operator import getitem
 from pathlib import (Path, PurePath, PurePosixPath, PureWindowsPath)
 import platform
-from typing import (Dict, Iterable, List, Match, Pattern, Set, Sequence, Tuple, Union)
+import queue
+import re
+import shutil
+import threading
+from typing import (Dict, Iterable, Iterator, List, Match, Pattern, Set, Sequence, Tuple, Union)
 import psutil
 
 """
@@ -20,6 +28,29 @@ DIRECTORY_PAIRING = Tuple[PATH_LIKE, PATH_LIKE]
 STR_ITERABLE = Iterable[str]
 STR_TUPLE = Tuple[str]
 STR_TUPLE_ITERABLE = Iterable[STR_TUPLE]
+# Number of threads that read directories at once, for the *_parallel walkers
+DEFAULT_WALK_WORKERS = 16
+# Number of directories' worth of results that the *_parallel walkers hold before waiting
+DEFAULT_WALK_QUEUE_SIZE = 256
+DEFAULT_HASH_NAME = 'sha1'
+DEFAULT_HASH_CHUNK_SIZE = 1024 * 1024
+TREE_COMPARE_OPTIONS = ('size', 'mtime', 'hash')
+# Matches the '{base} {n}' stems created by get_unique_filename
+NUMBERED_STEM = re.compile(r'^(.*) ([0-9]+)$')
+
+# Number of threads that run renames, for move_files
+DEFAULT_MOVE_WORKERS = 8
+# Number of moves between the same two directories that one thread runs at a time
+MOVE_CHUNK_SIZE = 64
+MOVE_MOVED = 'moved'
+MOVE_COPIED = 'copied'
+MOVE_UNCHANGED = 'unchanged'
+MOVE_FAILED = 'failed'
+MOVE_PLANNED = 'planned'
+MOVE_CLAIMED = 'claimed'
+
+TreeDiff = namedtuple('TreeDiff', ['only_first', 'only_second', 'common', 'different'])
+MoveResult = namedtuple('MoveResult', ['source', 'destination', 'status', 'error'])
 
 def get_clean_path(path_string:PATH_LIKE, check_for_file:bool=False) -> Path:
     """
@@ -113,14 +144,17 @@ def swap_dirs_if_needed(file_path:PATH_LIKE, alternate_directory_pairings:List[D
 
         return return_path
 
-def get_files(directory:PATH_LIKE, file_mask:str=None, recursive=True, exclusion_list:List[PATH_LIKE]=None) -> PATH_LIKE_ITERABLE:
+def get_files(directory:PATH_LIKE, file_mask:str=None, recursive=True, exclusion_list:List[PATH_LIKE]=None, index=None) -> PATH_LIKE_ITERABLE:
     """
     Returns files in the given directory or list of directories. The list can be
     optionally filtered by a glob string (file_mask) or exclusion_list.
+    If index (a dir_index.DirectoryIndex) is provided, the list is answered from it instead.
     """
     return_file_list = []
 
-    if is_iterable(directory):
+    if index is not None:
+        return_file_list = index.get_files(directory, file_mask, recursive, exclusion_list)
+    elif is_iterable(directory):
         for this_directory in directory:
             return_file_list += get_files(this_directory, file_mask, recursive, exclusion_list)
     else:
@@ -138,13 +172,185 @@ def get_files(directory:PATH_LIKE, file_mask:str=None, recursive=True, exclusion
 
     return return_file_list
 
-def get_dirs(directory:PATH_LIKE, recursive=False, include_symlinks=False) -> PATH_LIKE_ITERABLE:
+def __get_name_matcher__(file_mask:str=None):
+    """
+    Returns a function that returns True if a file name matches the glob string file_mask.
+    Names are matched the same way as fnmatch, but the mask is only normalized once.
+    """
+    mask_matches = re.compile(translate(os.path.normcase(file_mask or '*'))).match
+    if os.path.normcase('A') == 'A':
+        return lambda name: mask_matches(name) is not None
+    return lambda name: mask_matches(os.path.normcase(name)) is not None
+
+def __scan_directory__(dir_path:str, name_matches, exclusions:List[str], recursive:bool=True, include_files:bool=True,
+                       include_dirs:bool=False, include_symlinks:bool=False) -> Tuple[List[os.DirEntry], List[str]]:
+    """
+    Reads dir_path once, and returns a list of the entries that match name_matches (files and/or
+    directories), along with a list of child directories that should be scanned next.
+    Entries whose path contains an item in exclusions are skipped, and symlinked directories are
+    never descended into. Unreadable directories are treated as empty.
+    """
+    matching_entries = []
+    child_dirs = []
+    try:
+        dir_entries = os.scandir(dir_path)
+    except OSError:
+        return matching_entries, child_dirs
+    with dir_entries:
+        for dir_entry in dir_entries:
+            if len(exclusions) > 0 and any(e in dir_entry.path for e in exclusions):
+                continue
+            try:
+                is_dir = dir_entry.is_dir(follow_symlinks=False)
+                if is_dir is False and include_dirs is True and include_symlinks is True and dir_entry.is_dir():
+                    # Symlinked directories can be returned, but are not descended into
+                    if name_matches(dir_entry.name):
+                        matching_entries.append(dir_entry)
+                    continue
+            except OSError:
+                continue
+            if is_dir is True:
+                if recursive is True:
+                    child_dirs.append(dir_entry.path)
+                if include_dirs is True and name_matches(dir_entry.name):
+                    matching_entries.append(dir_entry)
+            elif include_files is True and name_matches(dir_entry.name):
+                matching_entries.append(dir_entry)
+    return matching_entries, child_dirs
+
+def iter_file_entries(directory:PATH_LIKE, file_mask:str=None, recursive=True, exclusion_list:List[PATH_LIKE]=None) -> Iterator[os.DirEntry]:
+    """
+    Yields an os.DirEntry for each file in the given directory or list of directories, as it
+    is found. The files can be filtered by a glob string (file_mask), which is matched against
+    the file name, or exclusion_list. Directories whose path contains an item in exclusion_list
+    are skipped without being read. Symlinked directories are not followed.
+    The entries cache the information from reading the directory, so calling is_file() or
+    stat() on them usually does not need another system call.
+    """
+    directories = directory if is_iterable(directory) else [directory]
+    name_matches = __get_name_matcher__(file_mask)
+    exclusions = [str(e) for e in exclusion_list or []]
+
+    for this_directory in directories:
+        pending_dirs = [str(Path(this_directory))]
+        while len(pending_dirs) > 0:
+            matching_entries, child_dirs = __scan_directory__(pending_dirs.pop(), name_matches, exclusions, recursive)
+            pending_dirs += child_dirs
+            yield from matching_entries
+
+def __walk_parallel__(directory:PATH_LIKE, file_mask:str=None, recursive=True, exclusion_list:List[PATH_LIKE]=None,
+                      include_files:bool=True, include_dirs:bool=False, include_symlinks:bool=False,
+                      max_workers:int=DEFAULT_WALK_WORKERS, queue_size:int=DEFAULT_WALK_QUEUE_SIZE) -> Iterator[os.DirEntry]:
+    """
+    Reads the given directory or list of directories (and their subdirectories, if recursive is True)
+    on max_workers threads, and yields the matching entries as they are found (see __scan_directory__).
+    Each thread takes the next directory to read from a shared stack, and adds the directories it finds
+    back to it. Results are passed back through a queue that holds up to queue_size directories' worth
+    of entries, so the threads wait if the caller stops reading. Entries are not in any particular order.
+    """
+    directories = directory if is_iterable(directory) else [directory]
+    name_matches = __get_name_matcher__(file_mask)
+    exclusions = [str(e) for e in exclusion_list or []]
+
+    pending_dirs = [str(Path(d)) for d in directories]
+    results = queue.Queue(maxsize=queue_size)
+    walk_state = threading.Condition()
+    active_count = 0
+    is_stopped = False
+    walk_done = object()
+
+    def put_result(result):
+        while is_stopped is False:
+            try:
+                results.put(result, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def walk_dirs():
+        nonlocal active_count
+        while True:
+            with walk_state:
+                while len(pending_dirs) == 0 and active_count > 0 and is_stopped is False:
+                    walk_state.wait()
+                if is_stopped is True or len(pending_dirs) == 0:
+                    walk_state.notify_all()
+                    return
+                dir_path = pending_dirs.pop()
+                active_count += 1
+            child_dirs = []
+            try:
+                matching_entries, child_dirs = __scan_directory__(dir_path, name_matches, exclusions, recursive,
+                                                                  include_files, include_dirs, include_symlinks)
+                if len(matching_entries) > 0:
+                    put_result(matching_entries)
+            finally:
+                with walk_state:
+                    pending_dirs.extend(child_dirs)
+                    active_count -= 1
+                    walk_state.notify_all()
+
+    def finish_walk(walk_threads):
+        for walk_thread in walk_threads:
+            walk_thread.join()
+        put_result(walk_done)
+
+    walk_threads = [threading.Thread(target=walk_dirs, daemon=True) for _ in range(max(1, max_workers))]
+    for walk_thread in walk_threads:
+        walk_thread.start()
+    threading.Thread(target=finish_walk, args=(walk_threads,), daemon=True).start()
+
+    try:
+        while True:
+            matching_entries = results.get()
+            if matching_entries is walk_done:
+                break
+            yield from matching_entries
+    finally:
+        with walk_state:
+            is_stopped = True
+            walk_state.notify_all()
+
+def iter_files_parallel(directory:PATH_LIKE, file_mask:str=None, recursive=True, exclusion_list:List[PATH_LIKE]=None,
+                        max_workers:int=DEFAULT_WALK_WORKERS) -> Iterator[Path]:
+    """
+    Yields the same files as iter_files, but directories are read by max_workers threads at
+    once, which hides the latency of slow or network file systems. All of the provided
+    directories are read by the same threads. Files are not returned in any particular order.
+    """
+    for dir_entry in __walk_parallel__(directory, file_mask, recursive, exclusion_list, max_workers=max_workers):
+        yield Path(dir_entry.path)
+
+def iter_dirs_parallel(directory:PATH_LIKE, recursive=False, include_symlinks=False, exclusion_list:List[PATH_LIKE]=None,
+                       max_workers:int=DEFAULT_WALK_WORKERS) -> Iterator[Path]:
+    """
+    Yields the same child directories as get_dirs, but directories are read by max_workers
+    threads at once (see iter_files_parallel), and directories whose path contains an item
+    in exclusion_list are skipped. Directories are not returned in any particular order.
+    """
+    for dir_entry in __walk_parallel__(directory, None, recursive, exclusion_list, include_files=False, include_dirs=True,
+                                       include_symlinks=include_symlinks, max_workers=max_workers):
+        yield Path(dir_entry.path)
+
+def iter_files(directory:PATH_LIKE, file_mask:str=None, recursive=True, exclusion_list:List[PATH_LIKE]=None) -> Iterator[Path]:
+    """
+    Yields files in the given directory or list of directories as they are found, like get_files,
+    but directories are read with os.scandir, and excluded directories are never descended into.
+    Unlike get_files, directories are not returned. See iter_file_entries for more detail.
+    """
+    for dir_entry in iter_file_entries(directory, file_mask, recursive, exclusion_list):
+        yield Path(dir_entry.path)
+
+def get_dirs(directory:PATH_LIKE, recursive=False, include_symlinks=False, index=None) -> PATH_LIKE_ITERABLE:
     """
     Returns a list of child directories for the provided path or paths.
     Does not include symlinks by default.
+    If index (a dir_index.DirectoryIndex) is provided, the list is answered from it instead.
     """
     return_list = []
-    if is_iterable(directory):
+    if index is not None:
+        return_list = index.get_dirs(directory, recursive, include_symlinks)
+    elif is_iterable(directory):
         for this_dir in directory:
             return_list += get_dirs(this_dir, recursive)
     else:
@@ -161,18 +367,129 @@ def get_dirs(directory:PATH_LIKE, recursive=False, include_symlinks=False) -> PA
 
     return return_list
 
+def __get_tree_entries__(directory:PATH_LIKE, include_files:bool=True, exclusion_list:List[PATH_LIKE]=None,
+                         max_workers:int=DEFAULT_WALK_WORKERS) -> Dict[str, os.DirEntry]:
+    """
+    Reads the whole tree under directory once, and returns a dict of {relative path: os.DirEntry}
+    for its directories (not including symlinks) and, if include_files is True, its files.
+    """
+    prefix_length = len(os.path.join(str(Path(directory)), ''))
+    return {
+        e.path[prefix_length:]: e
+        for e in __walk_parallel__(directory, None, True, exclusion_list, include_files=include_files, include_dirs=True,
+                                   max_workers=max_workers)
+    }
+
+def get_file_hash(filename:PATH_LIKE, hash_name:str=DEFAULT_HASH_NAME, chunk_size:int=DEFAULT_HASH_CHUNK_SIZE) -> str:
+    """
+    Returns the hex digest of the contents of filename, using the hashlib algorithm hash_name.
+    """
+    file_hash = hashlib.new(hash_name)
+    with open(str(filename), 'rb') as input_file:
+        for file_chunk in iter(lambda: input_file.read(chunk_size), b''):
+            file_hash.update(file_chunk)
+    return file_hash.hexdigest()
+
+def __entries_differ__(first_entry:os.DirEntry, second_entry:os.DirEntry, compare_by:List[str]) -> bool:
+    """
+    Returns True if the two entries are not the same type (file, directory or symlink), if they are
+    symlinks to different targets, or if their size or mtime differ and 'size' or 'mtime' (or 'hash',
+    for size) are in compare_by. Entries that can no longer be read are treated as different.
+    Contents are not compared; see __needs_hash__.
+    """
+    try:
+        first_is_symlink = first_entry.is_symlink()
+        if first_is_symlink != second_entry.is_symlink():
+            return True
+        if first_is_symlink is True:
+            return len(compare_by) > 0 and os.readlink(first_entry.path) != os.readlink(second_entry.path)
+        first_is_dir = first_entry.is_dir(follow_symlinks=False)
+        if first_is_dir != second_entry.is_dir(follow_symlinks=False):
+            return True
+        if first_is_dir is True:
+            return False
+        first_stat = first_entry.stat(follow_symlinks=False)
+        second_stat = second_entry.stat(follow_symlinks=False)
+    except OSError:
+        return True
+    if ('size' in compare_by or 'hash' in compare_by) and first_stat.st_size != second_stat.st_size:
+        return True
+    if 'mtime' in compare_by and first_stat.st_mtime_ns != second_stat.st_mtime_ns:
+        return True
+    return False
+
+def __needs_hash__(first_entry:os.DirEntry, second_entry:os.DirEntry, compare_by:List[str]) -> bool:
+    """
+    Returns True if 'hash' is in compare_by, and both entries are regular files (not symlinks)
+    """
+    try:
+        return 'hash' in compare_by and first_entry.is_file(follow_symlinks=False) and second_entry.is_file(follow_symlinks=False)
+    except OSError:
+        return False
+
+def __get_file_hash_or_none__(filename:str) -> str:
+    """
+    Returns get_file_hash(filename), or None if the file can't be read
+    """
+    try:
+        return get_file_hash(filename)
+    except OSError:
+        return None
+
+def diff_trees(first_path:PATH_LIKE, second_path:PATH_LIKE, include_files:bool=True, compare_by:Union[str, List[str]]=None,
+               exclusion_list:List[PATH_LIKE]=None, max_workers:int=DEFAULT_WALK_WORKERS) -> TreeDiff:
+    """
+    Compares the trees under first_path and second_path, and returns a TreeDiff of sets of relative
+    paths: only_first, only_second and common (which are in both trees, including the ones that differ).
+    Each tree is read once, and both are read at the same time (see iter_files_parallel). If include_files
+    is False, only directories are compared. Symlinks (including symlinked directories) are not followed.
+    compare_by can include 'size', 'mtime' and/or 'hash'. The common files that differ in any of those
+    are returned in different, along with any path that is a different type in each tree, and, if
+    compare_by is not empty, symlinks with different targets. Only regular files are hashed, and
+    only when their sizes are the same. Files that can't be read are treated as different.
+    """
+    compare_by = [compare_by] if isinstance(compare_by, str) else list(compare_by or [])
+    invalid_options = [c for c in compare_by if c not in TREE_COMPARE_OPTIONS]
+    if len(invalid_options) > 0:
+        raise AttributeError('The provided value for compare_by is invalid!\nProvided value: {0}'.format(invalid_options))
+
+    with ThreadPool(2) as pool:
+        first_entries, second_entries = pool.starmap(
+            __get_tree_entries__, [(p, include_files, exclusion_list, max_workers) for p in (first_path, second_path)]
+        )
+        common_paths = first_entries.keys() & second_entries.keys()
+        different_paths = set()
+        hash_paths = []
+        for common_path in common_paths:
+            first_entry, second_entry = first_entries[common_path], second_entries[common_path]
+            if __entries_differ__(first_entry, second_entry, compare_by) is True:
+                different_paths.add(common_path)
+            elif __needs_hash__(first_entry, second_entry, compare_by) is True:
+                hash_paths.append(common_path)
+
+    if len(hash_paths) > 0:
+        with ThreadPool(max(1, max_workers)) as pool:
+            first_hashes = pool.map(__get_file_hash_or_none__, [first_entries[p].path for p in hash_paths])
+            second_hashes = pool.map(__get_file_hash_or_none__, [second_entries[p].path for p in hash_paths])
+        different_paths.update(p for p, f, s in zip(hash_paths, first_hashes, second_hashes) if f is None or f != s)
+
+    return TreeDiff(
+        {Path(p) for p in first_entries.keys() - common_paths},
+        {Path(p) for p in second_entries.keys() - common_paths},
+        {Path(p) for p in common_paths},
+        {Path(p) for p in different_paths}
+    )
+
 def get_unique_paths(first_path:PATH_LIKE, second_path:PATH_LIKE) -> Path:
     """
     Yields a iterator of all paths in the first path that are not in the second path.
-    Is only as recursive as it needs to be.
+    Is only as recursive as it needs to be, so directories inside a unique directory are not returned.
+    Both trees are only read once (see diff_trees).
     """
-    first_path_children = {p.name:p for p in get_dirs(first_path)} # type: Dict[str, Path]
-    second_path_children = {p.name:p for p in get_dirs(second_path)} # type: Dict[str, Path]
-    for f_path, f_path_obj in first_path_children.items():
-        if f_path in second_path_children:
-            yield from get_unique_paths(f_path_obj, second_path_children[f_path])
-        else:
-            yield f_path_obj
+    only_first = diff_trees(first_path, second_path, include_files=False).only_first
+    for relative_path in only_first:
+        if relative_path.parent not in only_first:
+            yield Path(first_path).joinpath(relative_path)
 
 def safe_move(source_filename:PATH_LIKE, destination_filename:PATH_LIKE, force:bool=False) -> Path:
     """
@@ -245,4 +562,269 @@ def get_unique_filename(new_filename:PATH_LIKE) -> Path:
         append_value += 1
         new_file_path = Path('{0} {1}{2}'.format(base_file_name, str(append_value), file_suffix))
 
-    return new_file_path
\ No newline at end of file
+    return new_file_path
+
+class UniqueNameAllocator(object):
+    """
+    Hands out unique filenames, in the same '{base} {n}{suffix}' format as get_unique_filename,
+    for many files at once. Each directory is listed once, the first time a name in it is requested,
+    and the taken names and highest number used for each base name are kept in memory, so each
+    name is found without checking the file system. Numbers are not reused, so gaps in the
+    existing numbers are not filled in the way get_unique_filename fills them.
+    Names handed out by claim_filename are created (as empty files) with O_EXCL, so another thread
+    or process can not claim the same name. The allocator is safe to share between threads.
+    """
+    def __init__(self):
+        self.directory_lock = threading.Lock()
+        self.taken_names = {} # type: Dict[str, Set[str]]
+        self.dir_names = {} # type: Dict[str, Set[str]]
+        self.max_numbers = {} # type: Dict[str, Dict[Tuple[str, str], int]]
+
+    def __add_name__(self, dir_key:str, filename:str):
+        """
+        Marks filename as taken in dir_key, and updates the highest number used for its base name.
+        """
+        name_key = os.path.normcase(filename)
+        self.taken_names[dir_key].add(name_key)
+        name_stem, name_suffix = os.path.splitext(name_key)
+        stem_match = NUMBERED_STEM.match(name_stem)
+        if stem_match is not None:
+            stem_key = (stem_match.group(1), name_suffix)
+            max_numbers = self.max_numbers[dir_key]
+            max_numbers[stem_key] = max(max_numbers.get(stem_key, 0), int(stem_match.group(2)))
+
+    def __load_directory__(self, directory:str) -> str:
+        """
+        Lists directory, if it has not been listed yet, and returns its key.
+        """
+        dir_key = os.path.normcase(os.path.abspath(directory))
+        if dir_key not in self.taken_names:
+            self.taken_names[dir_key] = set()
+            self.dir_names[dir_key] = set()
+            self.max_numbers[dir_key] = {}
+            try:
+                with os.scandir(directory) as dir_entries:
+                    for dir_entry in dir_entries:
+                        self.__add_name__(dir_key, dir_entry.name)
+                        if dir_entry.is_dir():
+                            self.dir_names[dir_key].add(os.path.normcase(dir_entry.name))
+            except FileNotFoundError:
+                pass
+        return dir_key
+
+    def is_taken(self, filename:PATH_LIKE) -> bool:
+        """
+        Returns True if filename existed when its directory was listed, or has been handed out since.
+        """
+        file_path = Path(filename)
+        with self.directory_lock:
+            dir_key = self.__load_directory__(str(file_path.parent))
+            return os.path.normcase(file_path.name) in self.taken_names[dir_key]
+
+    def is_dir(self, filename:PATH_LIKE) -> bool:
+        """
+        Returns True if filename was a directory (or a symlink to one) when its directory was listed.
+        """
+        file_path = Path(filename)
+        with self.directory_lock:
+            dir_key = self.__load_directory__(str(file_path.parent))
+            return os.path.normcase(file_path.name) in self.dir_names[dir_key]
+
+    def get_unique_filename(self, new_filename:PATH_LIKE) -> Path:
+        """
+        Returns new_filename if it is not taken, or new_filename with the next unused number
+        appended, and marks the returned name as taken.
+        """
+        original_filename = Path(new_filename)
+        with self.directory_lock:
+            dir_key = self.__load_directory__(str(original_filename.parent))
+            new_file_path = original_filename
+            if os.path.normcase(original_filename.name) in self.taken_names[dir_key]:
+                stem_key = (os.path.normcase(original_filename.stem), os.path.normcase(original_filename.suffix))
+                append_value = self.max_numbers[dir_key].get(stem_key, 0)
+                while os.path.normcase(new_file_path.name) in self.taken_names[dir_key]:
+                    append_value += 1
+                    new_file_path = original_filename.with_name(
+                        '{0} {1}{2}'.format(original_filename.stem, str(append_value), original_filename.suffix)
+                    )
+            self.__add_name__(dir_key, new_file_path.name)
+        return new_file_path
+
+    def claim_filename(self, new_filename:PATH_LIKE) -> Path:
+        """
+        Returns a unique filename (see get_unique_filename), after creating it as an empty file,
+        so that the name can not be taken by another process before it is used. The caller should
+        replace the file (os.replace), or remove it with release_filename.
+        """
+        while True:
+            new_file_path = self.get_unique_filename(new_filename)
+            try:
+                os.close(os.open(str(new_file_path), os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                return new_file_path
+            except FileExistsError:
+                # Created by someone else since the directory was listed, so it stays taken
+                continue
+
+    def release_filename(self, filename:PATH_LIKE, remove_file:bool=True):
+        """
+        Marks filename as available again. If remove_file is True, the (empty) file created
+        by claim_filename is also removed.
+        """
+        file_path = Path(filename)
+        if remove_file is True:
+            try:
+                os.remove(str(file_path))
+            except FileNotFoundError:
+                pass
+        with self.directory_lock:
+            dir_key = self.__load_directory__(str(file_path.parent))
+            self.taken_names[dir_key].discard(os.path.normcase(file_path.name))
+
+def __copy_and_remove__(source_filename:str, destination_filename:str):
+    """
+    Moves source_filename to destination_filename across file systems, by copying it (with its
+    metadata) to a temporary file next to destination_filename, replacing destination_filename
+    with it, and then removing source_filename.
+    """
+    temp_filename = '{0}.{1}.partial'.format(destination_filename, os.getpid())
+    try:
+        shutil.copy2(source_filename, temp_filename)
+        os.replace(temp_filename, destination_filename)
+    except BaseException:
+        if os.path.exists(temp_filename):
+            os.remove(temp_filename)
+        raise
+    os.remove(source_filename)
+
+def move_file(source_filename:str, destination_filename:str) -> str:
+    """
+    Renames source_filename to destination_filename, replacing it if it exists, and returns
+    MOVE_MOVED. If the files are on different file systems, source_filename is copied and
+    then removed, and MOVE_COPIED is returned.
+    """
+    try:
+        os.replace(source_filename, destination_filename)
+        return MOVE_MOVED
+    except OSError as move_error:
+        if move_error.errno != errno.EXDEV:
+            raise
+    __copy_and_remove__(source_filename, destination_filename)
+    return MOVE_COPIED
+
+def __claim_destination__(destination:Path, allocator:UniqueNameAllocator, rename_taken:bool=True) -> Path:
+    """
+    Creates destination as an empty file with O_EXCL, just before a file is moved to it, and returns it.
+    If it was created by someone else since its directory was listed, the next unique name is claimed
+    instead (see UniqueNameAllocator.claim_filename), or the FileExistsError is raised if rename_taken is False.
+    """
+    try:
+        os.close(os.open(str(destination), os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        return destination
+    except FileExistsError:
+        if rename_taken is False:
+            raise
+    return allocator.claim_filename(destination)
+
+def __move_file_group__(planned_moves:List[Tuple[int, MoveResult]], allocator:UniqueNameAllocator,
+                        rename_taken:bool=True) -> List[Tuple[int, MoveResult]]:
+    """
+    Runs the planned (plan index, MoveResult) moves, claiming each MOVE_CLAIMED destination just before
+    it is moved to (see __claim_destination__), and returns a list of (plan index, MoveResult) with
+    their final status and destination.
+    """
+    move_results = []
+    for plan_index, planned_move in planned_moves:
+        is_claimed = False
+        try:
+            if planned_move.status == MOVE_CLAIMED:
+                planned_move = planned_move._replace(destination=__claim_destination__(planned_move.destination, allocator, rename_taken))
+                is_claimed = True
+            move_status = move_file(str(planned_move.source), str(planned_move.destination))
+            move_results.append((plan_index, planned_move._replace(status=move_status)))
+        except OSError as move_error:
+            if is_claimed is True:
+                allocator.release_filename(planned_move.destination)
+            move_results.append((plan_index, planned_move._replace(status=MOVE_FAILED, error=move_error)))
+    return move_results
+
+def resolve_moves(move_plan:Iterable[Tuple[PATH_LIKE, PATH_LIKE]], force:bool=False, allocator:UniqueNameAllocator=None) -> List[MoveResult]:
+    """
+    Resolves the final destination of each (source, destination) pair in move_plan, following the same
+    rules as safe_move, and returns a MoveResult for each pair, in the same order, without moving anything.
+    Each destination directory is listed once (see UniqueNameAllocator), and two pairs in the plan can
+    not be given the same name. Unless force is True, a destination that is taken is given a unique name,
+    which is reserved in allocator (status MOVE_CLAIMED), and only created on disk just before its move
+    (see iter_run_moves), so nothing is left behind if the moves are never run. With force, destinations
+    have a status of MOVE_PLANNED. Pairs that do not need to be moved are MOVE_UNCHANGED.
+    """
+    if allocator is None:
+        allocator = UniqueNameAllocator()
+    move_results = [] # type: List[MoveResult]
+
+    for source_filename, destination_filename in move_plan:
+        input_filename = os.path.abspath(str(source_filename))
+        output_filename = str(destination_filename)
+        if os.path.dirname(output_filename) == '':
+            output_filename = os.path.join(os.path.dirname(input_filename), output_filename)
+        output_filename = os.path.abspath(output_filename)
+        if allocator.is_dir(output_filename):
+            output_filename = os.path.join(output_filename, os.path.basename(input_filename))
+
+        if os.path.normcase(input_filename) == os.path.normcase(output_filename):
+            move_results.append(MoveResult(Path(input_filename), Path(output_filename), MOVE_UNCHANGED, None))
+            continue
+        if allocator.is_taken(output_filename):
+            try:
+                is_same_file = os.path.samefile(input_filename, output_filename)
+            except OSError:
+                is_same_file = False
+            if is_same_file is True:
+                move_results.append(MoveResult(Path(input_filename), Path(input_filename), MOVE_UNCHANGED, None))
+                continue
+        if force is True:
+            move_results.append(MoveResult(Path(input_filename), Path(output_filename), MOVE_PLANNED, None))
+            continue
+        output_filename = str(allocator.get_unique_filename(output_filename))
+        move_results.append(MoveResult(Path(input_filename), Path(output_filename), MOVE_CLAIMED, None))
+
+    return move_results
+
+def iter_run_moves(planned_moves:List[MoveResult], max_workers:int=DEFAULT_MOVE_WORKERS,
+                   allocator:UniqueNameAllocator=None, rename_taken:bool=True) -> Iterator[Tuple[int, MoveResult]]:
+    """
+    Runs the MOVE_PLANNED and MOVE_CLAIMED moves from resolve_moves on max_workers threads, in chunks of
+    up to MOVE_CHUNK_SIZE moves that share a source and destination directory, and yields a
+    (plan index, MoveResult) for each one as its chunk finishes. Each MOVE_CLAIMED destination is created
+    with O_EXCL just before it is moved to. If another process has created it since the plan was made,
+    the file is moved to the next unique name instead (allocator should be the one that was passed to
+    resolve_moves), or the move fails if rename_taken is False. Failed moves have a status of MOVE_FAILED
+    and the error, instead of raising it, and their claimed destination is released.
+    """
+    if allocator is None:
+        allocator = UniqueNameAllocator()
+    move_groups = {} # type: Dict[Tuple[str, str], List[Tuple[int, MoveResult]]]
+    for plan_index, planned_move in enumerate(planned_moves):
+        if planned_move.status in (MOVE_PLANNED, MOVE_CLAIMED):
+            group_key = (str(planned_move.source.parent), str(planned_move.destination.parent))
+            move_groups.setdefault(group_key, []).append((plan_index, planned_move))
+    move_chunks = [g[i:i + MOVE_CHUNK_SIZE] for g in move_groups.values() for i in range(0, len(g), MOVE_CHUNK_SIZE)]
+
+    with ThreadPool(max(1, max_workers)) as pool:
+        for chunk_results in pool.imap_unordered(lambda c: __move_file_group__(c, allocator, rename_taken), move_chunks):
+            yield from chunk_results
+
+def move_files(move_plan:Iterable[Tuple[PATH_LIKE, PATH_LIKE]], force:bool=False, max_workers:int=DEFAULT_MOVE_WORKERS,
+               allocator:UniqueNameAllocator=None) -> List[MoveResult]:
+    """
+    Moves many files at once, following the same rules as safe_move for each (source, destination)
+    pair in move_plan, and returns a MoveResult for each pair, in the same order.
+    Destination names are resolved in one pass (see resolve_moves), and the moves are then run on
+    max_workers threads (see iter_run_moves). Files on different file systems are copied, and then
+    removed. Failed moves have a status of MOVE_FAILED and the error, instead of raising it.
+    """
+    if allocator is None:
+        allocator = UniqueNameAllocator()
+    move_results = resolve_moves(move_plan, force, allocator)
+    for plan_index, move_result in iter_run_moves(move_results, max_workers, allocator):
+        move_results[plan_index] = move_result
+    return move_results
@@ -0,0 +1,340 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import (absolute_import, division, generators, nested_scopes, print_function, unicode_literals, with_statement)
+from builtins import (bytes, dict, int, list, object, range, str, ascii, chr, hex, input, next, oct, open, pow, round, super, filter, map, zip)
+import json
+import os
+from pathlib import Path
+import re
+import stat
+import time
+from typing import (Dict, Iterable, List, Tuple)
+
+import futils
+
+"""
+Runs batches of renames from a plan that is written to an append-only journal first,
+so that an interrupted batch can be finished (replayed) or undone (rolled back).
+
+The journal has one JSON record per line:
+    plan:     a resolved move (see futils.resolve_moves), written before anything is moved
+    done:     a move that finished
+    undone:   a move that was rolled back
+    failed:   a move that failed, with its error
+    rollback_failed: a rollback that failed, with its error (the move stays done)
+Moves that resolve_moves could not plan, or that did not need to be run, are journaled as skipped.
+Destinations are only claimed (created) by apply, just before each move, so nothing is created
+on disk until the whole plan has been synced.
+"""
+
+PATH_LIKE = futils.PATH_LIKE
+# Number of done/undone records written between each fsync of the journal
+DEFAULT_SYNC_EVERY = 1000
+RECORD_PLAN = 'plan'
+RECORD_DONE = 'done'
+RECORD_UNDONE = 'undone'
+RECORD_FAILED = 'failed'
+RECORD_ROLLBACK_FAILED = 'rollback_failed'
+RECORD_SKIPPED = 'skipped'
+# Matches the temporary files that futils.move_file copies to across file systems
+PARTIAL_COPY_PATTERN = re.compile(r'^(.*)\.[0-9]+\.partial$')
+
+def get_plan_state(move_status:str) -> str:
+    """
+    Returns the journal state of a move that resolve_moves returned with move_status
+    """
+    return move_status if move_status in (futils.MOVE_PLANNED, futils.MOVE_CLAIMED) else RECORD_SKIPPED
+
+class RenameJournal(object):
+    """
+    A rename plan, and the state of each of its moves, backed by an append-only journal file.
+    Use plan_renames to create one, or open an existing journal after a crash, and then call
+    apply (which also replays an interrupted apply) or rollback.
+    Done records are fsync'ed in groups of sync_every, so after a crash the journal can be
+    missing the last few done records. Those moves are found by checking that the source is
+    gone and the destination exists.
+    Files that were overwritten because the plan was made with force=True can not be restored.
+    """
+    def __init__(self, journal_filename:PATH_LIKE, sync_every:int=DEFAULT_SYNC_EVERY):
+        self.journal_filename = str(journal_filename)
+        self.sync_every = max(1, sync_every)
+        self.planned_moves = [] # type: List[futils.MoveResult]
+        self.move_states = {} # type: Dict[int, str]
+        self.source_states = {} # type: Dict[int, Tuple[int, int, int]]
+        self.unsynced_count = 0
+        self.journal_file = None
+        self.read_journal()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """
+        Syncs and closes the journal file
+        """
+        if self.journal_file is not None:
+            self.sync()
+            self.journal_file.close()
+            self.journal_file = None
+
+    def read_journal(self):
+        """
+        Loads the plan, and the last state of each move, from the journal file.
+        A line that was cut off by a crash is ignored.
+        """
+        if not os.path.exists(self.journal_filename):
+            return
+        with open(self.journal_filename, 'r', encoding='utf-8') as journal_file:
+            for journal_line in journal_file:
+                try:
+                    journal_record = json.loads(journal_line)
+                except ValueError:
+                    continue
+                move_id = journal_record['id']
+                if journal_record['type'] == RECORD_PLAN:
+                    self.planned_moves.append(futils.MoveResult(
+                        Path(journal_record['source']), Path(journal_record['destination']), journal_record['status'], None
+                    ))
+                    self.move_states[move_id] = get_plan_state(journal_record['status'])
+                    if journal_record.get('source_state') is not None:
+                        self.source_states[move_id] = tuple(journal_record['source_state'])
+                else:
+                    self.move_states[move_id] = journal_record['type']
+
+    def sync(self):
+        """
+        Flushes the journal file to disk
+        """
+        if self.journal_file is not None and self.unsynced_count > 0:
+            self.journal_file.flush()
+            os.fsync(self.journal_file.fileno())
+            self.unsynced_count = 0
+
+    def add_record(self, record_type:str, move_id:int, **record_values):
+        """
+        Appends a record for move_id to the journal, and syncs it if sync_every records
+        have been written since the last sync.
+        """
+        if self.journal_file is None:
+            self.journal_file = open(self.journal_filename, 'a+', encoding='utf-8')
+            # Start a new line if the last one was cut off by a crash
+            if self.journal_file.tell() > 0:
+                self.journal_file.seek(self.journal_file.tell() - 1)
+                if self.journal_file.read(1) != '\n':
+                    self.journal_file.write('\n')
+        journal_record = {'type': record_type, 'id': move_id, 'time': time.time()}
+        journal_record.update(record_values)
+        self.journal_file.write(json.dumps(journal_record) + '\n')
+        self.unsynced_count += 1
+        if record_type != RECORD_PLAN:
+            self.move_states[move_id] = record_type
+        if self.unsynced_count >= self.sync_every:
+            self.sync()
+
+    def get_moves(self, move_state:str=None) -> List[Tuple[int, futils.MoveResult]]:
+        """
+        Returns a list of (id, planned move) for the moves in move_state, or all moves.
+        """
+        return [(i, m) for i, m in enumerate(self.planned_moves) if move_state is None or self.move_states.get(i) == move_state]
+
+    def is_pending(self, move_id:int) -> bool:
+        """
+        Returns True if the move still needs to be run
+        """
+        return self.move_states.get(move_id) in (futils.MOVE_PLANNED, futils.MOVE_CLAIMED, RECORD_FAILED)
+
+    def is_moved(self, move_id:int) -> bool:
+        """
+        Returns True if the source of the move is gone, and the destination is the same file
+        (device and inode) as the source was when it was planned, or is a copy of it (same size,
+        on another device).
+        """
+        planned_move = self.planned_moves[move_id]
+        source_state = self.source_states.get(move_id)
+        if source_state is None or os.path.lexists(str(planned_move.source)):
+            return False
+        try:
+            destination_stat = os.lstat(str(planned_move.destination))
+        except OSError:
+            return False
+        if (destination_stat.st_dev, destination_stat.st_ino) == source_state[:2]:
+            return True
+        return destination_stat.st_dev != source_state[0] and destination_stat.st_size == source_state[2]
+
+    def is_undone(self, move_id:int) -> bool:
+        """
+        Returns True if the destination of the move is gone, and the source is the same file
+        (device and inode) as it was when it was planned, or is a copy of it (same size, on the
+        same device), so the move was rolled back.
+        """
+        planned_move = self.planned_moves[move_id]
+        source_state = self.source_states.get(move_id)
+        if source_state is None or os.path.lexists(str(planned_move.destination)):
+            return False
+        try:
+            source_stat = os.lstat(str(planned_move.source))
+        except OSError:
+            return False
+        if (source_stat.st_dev, source_stat.st_ino) == source_state[:2]:
+            return True
+        return source_stat.st_dev == source_state[0] and source_stat.st_size == source_state[2]
+
+    def is_leftover_claim(self, move_id:int) -> bool:
+        """
+        Returns True if the destination of the move is the empty file that apply creates to claim
+        its name, left by a crash before the file was moved there: the move claims its destination,
+        the destination is an empty file, and the source is still the file that was planned.
+        """
+        planned_move = self.planned_moves[move_id]
+        source_state = self.source_states.get(move_id)
+        if planned_move.status != futils.MOVE_CLAIMED or source_state is None:
+            return False
+        try:
+            destination_stat = os.lstat(str(planned_move.destination))
+            source_stat = os.lstat(str(planned_move.source))
+        except OSError:
+            return False
+        return (stat.S_ISREG(destination_stat.st_mode) and destination_stat.st_size == 0 and
+                (source_stat.st_dev, source_stat.st_ino) == source_state[:2])
+
+    def __remove_partial_copies__(self, filenames:Iterable[str]):
+        """
+        Removes the temporary files that interrupted cross-device copies (see futils.move_file)
+        left next to filenames. Each directory is listed once.
+        """
+        dir_names = {} # type: Dict[str, set]
+        for filename in filenames:
+            dir_names.setdefault(os.path.dirname(filename), set()).add(os.path.basename(filename))
+        for dir_path, file_names in dir_names.items():
+            try:
+                dir_entries = os.listdir(dir_path)
+            except OSError:
+                continue
+            for entry_name in dir_entries:
+                partial_match = PARTIAL_COPY_PATTERN.match(entry_name)
+                if partial_match is not None and partial_match.group(1) in file_names:
+                    try:
+                        os.remove(os.path.join(dir_path, entry_name))
+                    except OSError:
+                        pass
+
+    def __find_undone_moves__(self):
+        """
+        Marks the done moves that were already rolled back as undone, since their undone record
+        was not synced before a crash.
+        """
+        for move_id in range(len(self.planned_moves)):
+            if self.move_states.get(move_id) in (RECORD_DONE, RECORD_ROLLBACK_FAILED) and self.is_undone(move_id):
+                self.add_record(RECORD_UNDONE, move_id, status=futils.MOVE_MOVED, recovered=True)
+
+    def __find_finished_moves__(self):
+        """
+        Marks the pending moves that were already run as done, since their done record
+        was not synced before a crash.
+        """
+        for move_id in range(len(self.planned_moves)):
+            if self.is_pending(move_id) and self.is_moved(move_id):
+                self.add_record(RECORD_DONE, move_id, status=futils.MOVE_MOVED, recovered=True)
+
+    def apply(self, max_workers:int=futils.DEFAULT_MOVE_WORKERS) -> List[futils.MoveResult]:
+        """
+        Runs the moves that are not done yet (see futils.iter_run_moves), journaling each one as
+        it finishes, and returns a MoveResult for every move in the plan. Moves that failed in an
+        earlier apply are tried again. Each move is made to its journaled destination; if something
+        else has been created there since the plan was made, the move fails.
+        """
+        self.__find_finished_moves__()
+        pending_ids = [i for i in range(len(self.planned_moves)) if self.is_pending(i)]
+        self.__remove_partial_copies__(str(self.planned_moves[i].destination) for i in pending_ids)
+        for move_id in pending_ids:
+            if self.is_leftover_claim(move_id):
+                os.remove(str(self.planned_moves[move_id].destination))
+        pending_moves = [m if self.is_pending(i) else m._replace(status=futils.MOVE_UNCHANGED) for i, m in enumerate(self.planned_moves)]
+        move_results = list(self.planned_moves)
+        try:
+            for move_id, move_result in futils.iter_run_moves(pending_moves, max_workers, rename_taken=False):
+                move_results[move_id] = move_result
+                if move_result.status == futils.MOVE_FAILED:
+                    self.add_record(RECORD_FAILED, move_id, error=str(move_result.error))
+                else:
+                    self.add_record(RECORD_DONE, move_id, status=move_result.status)
+        finally:
+            self.sync()
+        for move_id, planned_move in enumerate(self.planned_moves):
+            if self.move_states.get(move_id) == RECORD_DONE and move_results[move_id] is planned_move:
+                move_results[move_id] = planned_move._replace(status=futils.MOVE_MOVED)
+        return move_results
+
+    def rollback(self) -> List[futils.MoveResult]:
+        """
+        Moves every finished move back to its source, in the reverse order of the plan, and removes
+        the destinations that were claimed for moves that never ran. Returns a MoveResult (from the
+        destination back to the source) for each move that was rolled back, or that failed to be.
+        A move is not rolled back if something else has been created at its source since. Moves
+        that were already rolled back by an interrupted rollback are recognized (see is_undone),
+        and a move that could not be rolled back stays done, so apply does not run it again.
+        """
+        self.__find_finished_moves__()
+        self.__find_undone_moves__()
+        self.__remove_partial_copies__(
+            [str(m.source) for i, m in enumerate(self.planned_moves) if self.move_states.get(i) in (RECORD_DONE, RECORD_ROLLBACK_FAILED)] +
+            [str(m.destination) for i, m in enumerate(self.planned_moves) if self.is_pending(i)]
+        )
+        rollback_results = []
+        try:
+            for move_id, planned_move in reversed(list(enumerate(self.planned_moves))):
+                source_filename = str(planned_move.source)
+                destination_filename = str(planned_move.destination)
+                if self.move_states.get(move_id) in (RECORD_DONE, RECORD_ROLLBACK_FAILED):
+                    try:
+                        if os.path.lexists(source_filename):
+                            raise FileExistsError('The source file was recreated since it was moved!\nProvided file: {0}'.format(source_filename))
+                        move_status = futils.move_file(destination_filename, source_filename)
+                        self.add_record(RECORD_UNDONE, move_id, status=move_status)
+                        rollback_results.append(futils.MoveResult(planned_move.destination, planned_move.source, move_status, None))
+                    except OSError as rollback_error:
+                        self.add_record(RECORD_ROLLBACK_FAILED, move_id, error=str(rollback_error))
+                        rollback_results.append(futils.MoveResult(planned_move.destination, planned_move.source, futils.MOVE_FAILED, rollback_error))
+                elif self.is_pending(move_id):
+                    # Only remove the empty file that was created to claim the name, if the move was
+                    # interrupted between claiming it and moving
+                    if self.is_leftover_claim(move_id):
+                        os.remove(destination_filename)
+                    self.add_record(RECORD_UNDONE, move_id, status=futils.MOVE_UNCHANGED)
+        finally:
+            self.sync()
+        return rollback_results
+
+def plan_renames(move_plan:Iterable[Tuple[PATH_LIKE, PATH_LIKE]], journal_filename:PATH_LIKE, force:bool=False,
+                 sync_every:int=DEFAULT_SYNC_EVERY) -> RenameJournal:
+    """
+    Resolves every destination in move_plan (see futils.resolve_moves), writes the plan to a new
+    journal at journal_filename and syncs it, and returns the RenameJournal, without moving anything.
+    The device, inode and size of each source are journaled too, so that moves can be recognized
+    after a crash. Moves whose source is missing are journaled as skipped.
+    Raises a FileExistsError if journal_filename already exists, since it may belong to an unfinished batch.
+    """
+    if os.path.exists(str(journal_filename)):
+        raise FileExistsError('The provided journal already exists!\nProvided file: {0}'.format(str(journal_filename)))
+    rename_journal = RenameJournal(journal_filename, sync_every)
+    for move_id, planned_move in enumerate(futils.resolve_moves(move_plan, force)):
+        source_state = None
+        if get_plan_state(planned_move.status) != RECORD_SKIPPED:
+            try:
+                source_stat = os.lstat(str(planned_move.source))
+                source_state = (source_stat.st_dev, source_stat.st_ino, source_stat.st_size)
+            except OSError as source_error:
+                planned_move = planned_move._replace(status=futils.MOVE_FAILED, error=source_error)
+        rename_journal.planned_moves.append(planned_move)
+        rename_journal.move_states[move_id] = get_plan_state(planned_move.status)
+        if source_state is not None:
+            rename_journal.source_states[move_id] = source_state
+        rename_journal.add_record(RECORD_PLAN, move_id, source=str(planned_move.source), destination=str(planned_move.destination),
+                                  status=planned_move.status, source_state=source_state,
+                                  error=None if planned_move.error is None else str(planned_move.error))
+    # The whole plan has to be on disk before anything is moved
+    rename_journal.sync()
+    return rename_journal
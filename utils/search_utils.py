@@ -2,40 +2,210 @@
 # -*- coding: utf-8 -*-
 from __future__ import (absolute_import, division, generators, nested_scopes, print_function, unicode_literals, with_statement)
 from builtins import (bytes, dict, int, list, object, range, str, ascii, chr, hex, input, next, oct, open, pow, round, super, filter, map, zip)
+from collections import namedtuple
+import errno
+from multiprocessing.pool import ThreadPool
 from pathlib import Path, PurePosixPath, PureWindowsPath
 import os
 import re
 import shutil
-from typing import (Dict, Set, List, Tuple, Sequence, Union, Pattern, Match)
+import stat
+from typing import (Dict, Iterable, Set, List, Tuple, Sequence, Union, Pattern, Match)
 import tempfile
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
 import futils
 
-def copy_file(input_file:Union[str, Path], new_file:Union[str, Path]) -> Path:
+# ioctl request that clones a file's data blocks, from <linux/fs.h>
+FICLONE = 0x40049409
+# Largest number of bytes that is copied by one copy_file_range/sendfile call
+COPY_CHUNK_SIZE = 1024 * 1024 * 1024
+COPY_BUFFER_SIZE = 8 * 1024 * 1024
+# Smallest buffer used by the buffered copy, so small files don't allocate a full COPY_BUFFER_SIZE buffer
+MIN_COPY_BUFFER_SIZE = 64 * 1024
+# Number of threads that copy files at once, for copy_files
+DEFAULT_COPY_WORKERS = 8
+COPY_COPIED = 'copied'
+COPY_FAILED = 'failed'
+# Errors that mean a copy method is not supported for these files, so the next one should be tried
+UNSUPPORTED_COPY_ERRORS = {errno.EXDEV, errno.EINVAL, errno.ENOSYS, errno.ENOTSUP, errno.EOPNOTSUPP, errno.ENOTTY, errno.EBADF, errno.EPERM}
+
+CopyResult = namedtuple('CopyResult', ['source', 'destination', 'status', 'error'])
+
+def __open_destination__(source_fd:int, new_file:str) -> int:
+    """
+    Creates new_file, with the same permissions as the open source file, and returns its descriptor.
+    Fails if new_file already exists, so two copies can not write to the same file.
+    """
+    try:
+        return os.open(new_file, os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, 'O_BINARY', 0), os.fstat(source_fd).st_mode & 0o777)
+    except FileExistsError:
+        raise OSError('The destination file already exists!\nProvided file:{0}'.format(new_file))
+
+def __reflink_file__(source_fd:int, destination_fd:int, file_size:int):
+    """
+    Makes the destination share the source's data blocks (a reflink), on file systems like Btrfs and XFS
+    """
+    if fcntl is None:
+        raise OSError(errno.ENOTSUP, 'Reflinks are not supported on this system')
+    fcntl.ioctl(destination_fd, FICLONE, source_fd)
+
+def __get_chunk_size__(file_size:int) -> int:
+    """
+    Returns the number of bytes to ask for in each copy_file_range/sendfile call. file_size
+    is only a hint, since the file can grow during the copy, and pseudo-files report a size of 0.
+    """
+    return min(max(file_size, COPY_BUFFER_SIZE), COPY_CHUNK_SIZE)
+
+def __copy_file_range__(source_fd:int, destination_fd:int, file_size:int):
+    """
+    Copies the source to the destination inside the kernel, with os.copy_file_range, until it
+    reaches the end of the source. Raises an unsupported error if nothing could be copied, so
+    that pseudo-files (like the ones in /proc) are copied with the next method instead.
+    """
+    if hasattr(os, 'copy_file_range') is False:
+        raise OSError(errno.ENOSYS, 'os.copy_file_range is not available')
+    chunk_size = __get_chunk_size__(file_size)
+    offset = 0
+    while True:
+        bytes_copied = os.copy_file_range(source_fd, destination_fd, chunk_size, offset, offset)
+        if bytes_copied == 0:
+            break
+        offset += bytes_copied
+    if offset == 0:
+        raise OSError(errno.ENOTSUP, 'os.copy_file_range did not copy any data')
+
+def __sendfile__(source_fd:int, destination_fd:int, file_size:int):
+    """
+    Copies the source to the destination inside the kernel, with os.sendfile, until it reaches
+    the end of the source. Raises an unsupported error if nothing could be copied (see __copy_file_range__).
+    """
+    if hasattr(os, 'sendfile') is False:
+        raise OSError(errno.ENOSYS, 'os.sendfile is not available')
+    chunk_size = __get_chunk_size__(file_size)
+    offset = 0
+    while True:
+        bytes_copied = os.sendfile(destination_fd, source_fd, offset, chunk_size)
+        if bytes_copied == 0:
+            break
+        offset += bytes_copied
+    if offset == 0:
+        raise OSError(errno.ENOTSUP, 'os.sendfile did not copy any data')
+
+def __buffered_copy__(source_fd:int, destination_fd:int, file_size:int):
+    """
+    Copies the source to the destination through a buffer of up to COPY_BUFFER_SIZE bytes, which
+    is sized to fit file_size (a hint, as in __get_chunk_size__), but is never smaller than
+    MIN_COPY_BUFFER_SIZE
+    """
+    copy_buffer = bytearray(min(COPY_BUFFER_SIZE, max(file_size, MIN_COPY_BUFFER_SIZE)))
+    with open(source_fd, 'rb', buffering=0, closefd=False) as source_file:
+        for bytes_read in iter(lambda: source_file.readinto(copy_buffer), 0):
+            view = memoryview(copy_buffer)[:bytes_read]
+            while len(view) > 0:
+                view = view[os.write(destination_fd, view):]
+
+def check_copy_methods(copy_methods:Sequence[str]):
+    """
+    Raises a ValueError if copy_methods contains a method that is not in COPY_METHODS
+    """
+    invalid_methods = [m for m in copy_methods or [] if m not in COPY_FUNCTIONS]
+    if len(invalid_methods) > 0:
+        raise ValueError('The provided copy methods are invalid!\nProvided methods: {0}'.format(invalid_methods))
+
+def copy_file_data(source_filename:Union[str, Path], destination_filename:Union[str, Path], copy_methods:Sequence[str]=None) -> str:
+    """
+    Copies the contents and metadata (like shutil.copy2) of source_filename to destination_filename,
+    which must not exist yet, and returns the name of the method that was used. The methods in
+    copy_methods (default: COPY_METHODS) are tried in order, until one is supported by the platform
+    and file systems: 'reflink', 'copy_file_range', 'sendfile' and 'buffered'. Empty regular files
+    are always copied with 'buffered', since there is no data to copy in the kernel.
+    Raises a ValueError for unknown copy methods.
+    """
+    check_copy_methods(copy_methods)
+    source_filename = str(source_filename)
+    destination_filename = str(destination_filename)
+    try:
+        source_fd = os.open(source_filename, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+    except FileNotFoundError:
+        raise OSError('The provided input file does not exist!\nProvided file: {0}'.format(source_filename))
+    try:
+        destination_fd = __open_destination__(source_fd, destination_filename)
+        try:
+            source_stat = os.fstat(source_fd)
+            file_size = source_stat.st_size
+            if file_size == 0 and stat.S_ISREG(source_stat.st_mode):
+                # Pseudo-files also report a size of 0, so only regular files skip the kernel methods
+                copy_methods = ['buffered']
+            for copy_method in copy_methods or COPY_METHODS:
+                try:
+                    COPY_FUNCTIONS[copy_method](source_fd, destination_fd, file_size)
+                    break
+                except OSError as copy_error:
+                    if copy_method == 'buffered' or copy_error.errno not in UNSUPPORTED_COPY_ERRORS:
+                        raise
+                    # Start over with the next method
+                    os.ftruncate(destination_fd, 0)
+                    os.lseek(destination_fd, 0, os.SEEK_SET)
+            else:
+                raise OSError('None of the provided copy methods are supported!\nProvided methods: {0}'.format(copy_methods))
+        except BaseException:
+            os.close(destination_fd)
+            os.remove(destination_filename)
+            raise
+        os.close(destination_fd)
+    finally:
+        os.close(source_fd)
+    shutil.copystat(source_filename, destination_filename)
+    return copy_method
+
+def copy_file(input_file:Union[str, Path], new_file:Union[str, Path], verify:bool=False, copy_methods:Sequence[str]=None) -> Path:
     """
     Copies input_file to new_file, returning a Path object representing the destination file.
     If the new_file already exists, it will not be overwritten.
+    The first of copy_methods that the file systems support is used (see copy_file_data). If verify
+    is True, the checksums of both files are compared after the copy, and an OSError is raised
+    (and new_file is removed) if they differ.
     """
     source_file = futils.get_clean_path(input_file)
     destination_file = futils.get_clean_path(new_file)
-    try:
-        if source_file.exists() is False:
-            raise OSError('The provided input file does not exist!\nProvided file: {0}'.format(str(input_file)))
+    copy_file_data(source_file, destination_file, copy_methods)
 
-        if destination_file.exists() is True:
-            raise OSError('The destination file already exists!\nProvided file:{0}'.format(str(new_file)))
+    if verify is True and futils.get_file_hash(source_file) != futils.get_file_hash(destination_file):
+        os.remove(str(destination_file))
+        raise OSError('The copied file does not match the input file!\nProvided file: {0}'.format(str(input_file)))
 
-        shutil.copy2(str(source_file), str(destination_file))
+    return destination_file
 
-    except OSError:
-        raise
+def copy_files(copy_plan:Iterable[Tuple[Union[str, Path], Union[str, Path]]], max_workers:int=DEFAULT_COPY_WORKERS,
+               verify:bool=False, copy_methods:Sequence[str]=None) -> List[CopyResult]:
+    """
+    Copies each (input_file, new_file) pair in copy_plan with copy_file, on max_workers threads,
+    and returns a CopyResult for each pair, in the same order. Failed copies have a status of
+    COPY_FAILED and the error, instead of raising it. Raises a ValueError for unknown copy methods.
+    """
+    check_copy_methods(copy_methods)
+    def copy_pair(file_pair:Tuple[Union[str, Path], Union[str, Path]]) -> CopyResult:
+        input_file, new_file = file_pair
+        try:
+            return CopyResult(Path(input_file), copy_file(input_file, new_file, verify, copy_methods), COPY_COPIED, None)
+        except OSError as copy_error:
+            return CopyResult(Path(input_file), Path(new_file), COPY_FAILED, copy_error)
 
-    return destination_file
+    with ThreadPool(max(1, max_workers)) as pool:
+        return pool.map(copy_pair, list(copy_plan), chunksize=1)
 
-def replace_in_file(filename:Union[Path, str], search_value:Union[str, Pattern], replacement_string:str, use_regex:bool=False):
+def replace_in_file(filename:Union[Path, str], search_value:Union[str, Pattern], replacement_string:str, use_regex:bool=False,
+                    backup_store=None) -> bool:
     """
     Replaces search_value in filename, with replacement_string.
     If use_regex is True, or if search_value is a RegEx object, then RegEx will be used to find the values in the file
+    The original file is backed up to backup_store (a backup_store.BackupStore) if it is provided,
+    or copied to a .bak file otherwise. Returns False, without changing the file or making a backup,
+    if search_value was not found.
     """
     if use_regex is True or isinstance(search_value, Pattern):
         search_obj = re.compile(search_value)
@@ -52,18 +222,37 @@ def replace_in_file(filename:Union[Path, str], search_value:Union[str, Pattern],
         raise OSError('The provided file cannot be opened!\nProvided file: {0}'.format(str(filename)))
 
     temp_filename = futils.get_unique_filename(provided_file)
-    # Save the original filename
-    backup_file = futils.get_unique_filename('{0}.bak'.format(provided_filename))
-    copy_file(provided_filename, str(backup_file))
-
+    is_changed = False
     with open(provided_file, 'rt') as input_file:
         with open(temp_filename, 'wt') as temp_file:
             for input_string in input_file:
-                temp_file.write(replace_value(input_string))
+                output_string = replace_value(input_string)
+                is_changed = is_changed or output_string != input_string
+                temp_file.write(output_string)
+
+    if is_changed is False:
+        os.remove(str(temp_filename))
+        return False
+
+    # Save the original file
+    if backup_store is not None:
+        backup_store.backup_file(provided_filename)
+    else:
+        backup_file = futils.get_unique_filename('{0}.bak'.format(provided_filename))
+        copy_file(provided_filename, str(backup_file))
 
     shutil.move(temp_filename, provided_filename)
+    return True
 
+COPY_FUNCTIONS = {
+    'reflink': __reflink_file__,
+    'copy_file_range': __copy_file_range__,
+    'sendfile': __sendfile__,
+    'buffered': __buffered_copy__
+}
+COPY_METHODS = ('reflink', 'copy_file_range', 'sendfile', 'buffered')
 TEST_FILE = Path.joinpath(Path(__file__).parent, 'test_data', 'test_file.csv')
 TEST_SEARCH_STRING = '532012'
 
-replace_in_file(TEST_FILE, TEST_SEARCH_STRING, 'was replaced')
\ No newline at end of file
+if __name__ == '__main__':
+    replace_in_file(TEST_FILE, TEST_SEARCH_STRING, 'was replaced')
\ No newline at end of file